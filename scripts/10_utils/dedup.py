@@ -4,22 +4,63 @@
 # ///
 
 import os
+import csv
+import sys
+import json
+import mmap
+import time
+import sqlite3
 import logging
 import hashlib
+import filecmp
 import argparse
+import threading
+import collections
+import contextlib
 from pathlib import Path
-from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+from dataclasses import dataclass
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+try:
+    import blake3
+except ImportError:
+    blake3 = None
 
 
 logging.basicConfig(format='%(levelname)s - %(message)s', level=logging.INFO)
+action_logger = logging.getLogger('dedup.actions')
+
+PARTIAL_HASH_SIZE = 64 * 1024
+MMAP_MIN_SIZE = 16 * 1024 * 1024
+BATCH_SIZE = 256
+BATCH_BYTES = 64 * 1024 * 1024
+HASH_ALGOS = {
+    'blake2b': hashlib.blake2b,
+    'sha256': hashlib.sha256,
+    'blake3': blake3.blake3 if blake3 is not None else None,
+    'xxh3': xxhash.xxh3_128 if xxhash is not None else None,
+    'xxh64': xxhash.xxh64 if xxhash is not None else None,
+}
+CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'dedup'
+CACHE_FILE = CACHE_DIR / 'hashes.sqlite'
+INDEX_FILE = CACHE_DIR / 'index.sqlite'
+CACHE_MAX_AGE = 30 * 24 * 60 * 60
+PROGRESS_INTERVAL = 10.0
 
 
 def _get_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-        description='Deduplicates files in the passed directory using one of several strategies.',
+        description='Deduplicates files in the passed directories using one of several strategies.',
+    )
+    parser.add_argument(
+        'dir', metavar='DIR', nargs='+', help='The directories to process. Duplicates are also found across them.'
     )
-    parser.add_argument('dir', metavar='DIR', nargs=1, help='The directory to process')
     parser.add_argument(
         '-m',
         '--method',
@@ -49,34 +90,368 @@ def _get_args() -> argparse.Namespace:
     parser.add_argument(
         '-a', '--all', action='store_true', help='Include directories prefixed with a dot in processing.'
     )
+    parser.add_argument(
+        '-j', '--workers', type=int, default=os.cpu_count(), help='Number of files to hash in parallel.'
+    )
+    parser.add_argument(
+        '--backend',
+        choices=['process', 'thread'],
+        default='process',
+        help="""How to hash in parallel. 'process': in a pool of worker processes.
+        'thread': in a pool of threads, which avoids inter-process overhead since hashing releases the GIL.""",
+    )
+    parser.add_argument(
+        '--hash',
+        choices=list(HASH_ALGOS),
+        default='blake2b',
+        help="""Which hash function to identify duplicates with. 'blake3' requires the blake3 package,
+        'xxh3' and 'xxh64' require the xxhash package. Falls back to blake2b if the package is missing.
+        The non-cryptographic 'xxh3' and 'xxh64' are best combined with --verify.""",
+    )
+    parser.add_argument(
+        '--verify',
+        action='store_true',
+        help='Compare duplicates byte by byte with the principal before modifying them.',
+    )
+    parser.add_argument(
+        '--io-mode',
+        choices=['read', 'readinto', 'mmap'],
+        default='readinto',
+        help="""How to read files for hashing. 'read': in chunks of 8 KiB.
+        'readinto': into one reused buffer sized to the file, up to 1 MiB.
+        'mmap': map files of at least 16 MiB into memory, and read smaller ones like 'readinto'.
+        Only use 'mmap' when no other process writes to the files: a mapped file which is truncated
+        while it is hashed kills the process with SIGBUS, which cannot be caught.""",
+    )
+    parser.add_argument(
+        '--benchmark',
+        action='store_true',
+        help='Instead of deduplicating, time hashing all files in the directory with each --io-mode.',
+    )
+    parser.add_argument(
+        '--cache-file', metavar='PATH', type=Path, default=CACHE_FILE, help='Where to persist file hashes between runs.'
+    )
+    cache_mode = parser.add_mutually_exclusive_group()
+    cache_mode.add_argument('--no-cache', action='store_true', help='Neither read nor write the hash cache.')
+    cache_mode.add_argument(
+        '--rebuild-cache', action='store_true', help='Discard all cached hashes before processing.'
+    )
+    parser.add_argument(
+        '--report',
+        choices=['json', 'tsv'],
+        default=None,
+        help="""Write the duplicates found to stdout as they are found. 'json': one JSON object per group of
+        duplicates and line. 'tsv': one line per file, with the bytes reclaimable by resolving it.""",
+    )
+    parser.add_argument(
+        '--resolve-jobs',
+        type=int,
+        default=1,
+        help='Number of groups of duplicates to resolve in parallel.',
+    )
+    parser.add_argument(
+        '-q',
+        '--quiet',
+        action='store_true',
+        help='Do not log every single file system change, only progress and a summary.',
+    )
+    parser.add_argument(
+        '-i',
+        '--incremental',
+        action='store_true',
+        help="""Only consider duplicates involving files which are new or changed since the last incremental run
+        on the same directories, as recorded in the index file.""",
+    )
+    parser.add_argument(
+        '-w',
+        '--watch',
+        metavar='SECONDS',
+        type=float,
+        default=None,
+        help='Keep running incrementally, checking the directory for changes this often.',
+    )
+    parser.add_argument(
+        '--index-file',
+        metavar='PATH',
+        type=Path,
+        default=INDEX_FILE,
+        help='Where to persist the state of the directory for incremental runs.',
+    )
     return parser.parse_args()
 
 
-def _get_hash_if_file(p: Path) -> str | None:
+@dataclass(frozen=True, slots=True)
+class FileRecord:
+    """Everything needed about a file after the walk, captured from a single stat call."""
+
+    path: Path
+    dev: int
+    ino: int
+    size: int
+    mtime_ns: int
+    ctime: float
+    depth: int
+
+    @classmethod
+    def from_stat(cls, path: Path, st: os.stat_result, depth: int) -> 'FileRecord':
+        return cls(path, st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime, depth)
+
+
+@dataclass
+class RunStats:
+    files_walked: int = 0
+    bytes_walked: int = 0
+    groups: int = 0
+    files_resolved: int = 0
+    bytes_reclaimed: int = 0
+    walk_time: float = 0.0
+    hash_time: float = 0.0
+    resolve_time: float = 0.0
+
+    def progress(self) -> str:
+        return (
+            f'Resolved {self.groups} groups of duplicates with {self.files_resolved} redundant files, '
+            f'reclaiming {self.bytes_reclaimed / 2**20:.1f} MiB'
+        )
+
+    def summary(self) -> str:
+        total = self.walk_time + self.hash_time + self.resolve_time
+        return (
+            f'Walked {self.files_walked} files ({self.bytes_walked / 2**30:.2f} GiB), '
+            f'{self.files_walked / total if total else 0:.0f} files/s. {self.progress()}. '
+            f'Time: {self.walk_time:.2f}s walk, {self.hash_time:.2f}s hash, {self.resolve_time:.2f}s resolve'
+        )
+
+
+class HashCache:
+    """
+    Persistent store of file hashes, keyed on (device, inode, size, mtime_ns) of the hashed file.
+    Entries which have not been stored again for `max_age` seconds are evicted on close.
+    """
+
+    def __init__(
+        self, path: Path = CACHE_FILE, rebuild: bool = False, max_age: int = CACHE_MAX_AGE, algo: str = 'blake2b'
+    ) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._con = sqlite3.connect(path)
+        self._now = int(time.time())
+        self._max_age = max_age
+        self._algo = algo
+        if rebuild:
+            self._con.execute('DROP TABLE IF EXISTS hashes')
+        self._con.execute(
+            """CREATE TABLE IF NOT EXISTS hashes (
+                dev INTEGER, ino INTEGER, kind TEXT, size INTEGER, mtime_ns INTEGER, hash TEXT, seen INTEGER,
+                PRIMARY KEY (dev, ino, kind)
+            ) WITHOUT ROWID"""
+        )
+
+    def __enter__(self) -> 'HashCache':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def get(self, f: FileRecord, kind: str) -> str | None:
+        row = self._con.execute(
+            'SELECT size, mtime_ns, hash FROM hashes WHERE dev = ? AND ino = ? AND kind = ?',
+            (f.dev, f.ino, f'{kind}:{self._algo}'),
+        ).fetchone()
+        if row is None or row[:2] != (f.size, f.mtime_ns):
+            return None
+        return row[2]
+
+    def put(self, f: FileRecord, kind: str, hash_: str) -> None:
+        self._con.execute(
+            'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (f.dev, f.ino, f'{kind}:{self._algo}', f.size, f.mtime_ns, hash_, self._now),
+        )
+
+    def close(self) -> None:
+        self._con.execute('DELETE FROM hashes WHERE seen < ?', (self._now - self._max_age,))
+        self._con.commit()
+        self._con.close()
+
+
+class DupIndex:
+    """
+    Persistent snapshot of the files below a set of directories as of the last incremental run, along with
+    the partial and full hashes of those which were hashed. Tells which files are new or changed since, and
+    keeps the hashes of unchanged files, so that only the delta is hashed again.
+    Nothing is written if `persist` is false, or if the run fails.
+    """
+
+    _COLUMNS = ['root', 'path', 'size', 'mtime_ns', 'algo', 'partial', 'full']
+
+    def __init__(self, path: Path, roots: list[Path], persist: bool = True, algo: str = 'blake2b') -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._con = sqlite3.connect(path)
+        self._roots = [str(root) for root in roots]
+        self._persist = persist
+        self._algo = algo
+        columns = [row[1] for row in self._con.execute('PRAGMA table_info(files)')]
+        outdated = bool(columns) and columns != self._COLUMNS
+        if outdated and persist:
+            # written by an older version, rebuilt by this run
+            self._con.execute('DROP TABLE files')
+        self._con.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                root TEXT, path TEXT, size INTEGER, mtime_ns INTEGER, algo TEXT, partial TEXT, full TEXT,
+                PRIMARY KEY (root, path)
+            ) WITHOUT ROWID"""
+        )
+        self._known = {}
+        for root in self._roots if not outdated or persist else []:
+            self._known.update(
+                (path, (root, size, mtime_ns, algo, partial, full))
+                for path, size, mtime_ns, algo, partial, full in self._con.execute(
+                    'SELECT path, size, mtime_ns, algo, partial, full FROM files WHERE root = ?', (root,)
+                )
+            )
+        self._changed = []
+        # hashes of unchanged files by kind, and the files whose hashes are to be written
+        self._hashes: dict[str, dict[str, str]] = {}
+        self._hashed = set()
+
+    def __enter__(self) -> 'DupIndex':
+        return self
+
+    def __exit__(self, exc_type, *_) -> None:
+        # a failed or interrupted run has neither walked all files nor resolved all duplicates among them
+        self.close(persist=exc_type is None)
+
+    def _root_of(self, p: Path) -> str:
+        return next(root for root in self._roots if str(p).startswith(root.rstrip(os.sep) + os.sep))
+
+    def changed(self, f: FileRecord, root: Path) -> bool:
+        """Check whether a file is new or changed since the last run. Each file must only be checked once."""
+        known = self._known.pop(str(f.path), None)
+        if known is not None and known[:3] == (str(root), f.size, f.mtime_ns):
+            if known[3] == self._algo:
+                hashes = {'partial': known[4], 'full': known[5]}
+                self._hashes[str(f.path)] = {kind: hash_ for kind, hash_ in hashes.items() if hash_ is not None}
+            return False
+        self._changed.append((str(root), str(f.path), f.size, f.mtime_ns, None, None, None))
+        return True
+
+    def get(self, f: FileRecord, kind: str) -> str | None:
+        """The hash of an unchanged file recorded by the last run, if any."""
+        return self._hashes.get(str(f.path), {}).get(kind)
+
+    def put(self, f: FileRecord, kind: str, hash_: str) -> None:
+        hashes = self._hashes.setdefault(str(f.path), {})
+        if hashes.get(kind) != hash_:
+            hashes[kind] = hash_
+            self._hashed.add(f.path)
+
+    def refresh(self, paths: list[Path]) -> None:
+        """Update the recorded state of files after they have been modified by this run."""
+        self._flush()
+        for p in paths:
+            try:
+                st = p.lstat()
+            except FileNotFoundError:
+                st = None
+            if st is None or not p.is_file() or p.is_symlink():
+                self._con.execute('DELETE FROM files WHERE root = ? AND path = ?', (self._root_of(p), str(p)))
+            else:
+                self._con.execute(
+                    'UPDATE files SET size = ?, mtime_ns = ? WHERE root = ? AND path = ?',
+                    (st.st_size, st.st_mtime_ns, self._root_of(p), str(p)),
+                )
+
+    def _flush(self) -> None:
+        self._con.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)', self._changed)
+        self._changed = []
+        rows = []
+        for p in self._hashed:
+            hashes = self._hashes[str(p)]
+            rows.append((self._algo, hashes.get('partial'), hashes.get('full'), self._root_of(p), str(p)))
+        self._con.executemany('UPDATE files SET algo = ?, partial = ?, full = ? WHERE root = ? AND path = ?', rows)
+        self._hashed.clear()
+
+    def close(self, persist: bool = True) -> None:
+        if self._persist and persist:
+            # whatever was not seen during the walk is gone
+            self._flush()
+            self._con.executemany(
+                'DELETE FROM files WHERE root = ? AND path = ?', ((v[0], p) for p, v in self._known.items())
+            )
+            self._con.commit()
+        self._con.close()
+
+
+def _get_hash_algo(algo: str) -> str:
+    """Return `algo` if its implementation is available, or fall back to blake2b."""
+    if HASH_ALGOS[algo] is None:
+        logging.warning(f'Hash function {algo} is not installed, falling back to blake2b.')
+        return 'blake2b'
+    return algo
+
+
+def _get_partial_hash(p: Path, size: int = PARTIAL_HASH_SIZE, algo: str = 'blake2b') -> str:
+    """Hash only the first and last `size` bytes of a file."""
+    with open(p, 'rb') as fin:
+        file_hash = HASH_ALGOS[algo](fin.read(size))
+        fin.seek(-size, os.SEEK_END)
+        file_hash.update(fin.read(size))
+    return file_hash.hexdigest()
+
+
+_buffers = threading.local()
+
+
+def _get_buffer(size: int) -> memoryview:
+    """Return a view of `size` bytes into a buffer which is reused between calls from the same thread."""
+    buf = getattr(_buffers, 'buf', None)
+    if buf is None or len(buf) < size:
+        buf = _buffers.buf = bytearray(size)
+    return memoryview(buf)[:size]
+
+
+def _fadvise(fd: int, advice: str) -> None:
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, 0, 0, getattr(os, f'POSIX_FADV_{advice}'))
+
+
+def _get_hash_if_file(p: Path, io_mode: str = 'readinto', algo: str = 'blake2b') -> str | None:
     if p.is_file() and not p.is_symlink():
-        with open(p, 'rb') as fin:
-            file_hash = hashlib.blake2b()
-            while chunk := fin.read(8192):
-                file_hash.update(chunk)
+        with open(p, 'rb', buffering=0) as fin:
+            fd = fin.fileno()
+            size = os.fstat(fd).st_size
+            # read ahead aggressively, and do not keep the file in the page cache afterwards
+            _fadvise(fd, 'SEQUENTIAL')
+            file_hash = HASH_ALGOS[algo]()
+            if io_mode == 'mmap' and size >= MMAP_MIN_SIZE:
+                with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                    file_hash.update(mm)
+            elif io_mode in ('mmap', 'readinto'):
+                buf = _get_buffer(max(8192, min(size, 1024 * 1024)))
+                while n := fin.readinto(buf):
+                    file_hash.update(buf[:n])
+            else:
+                while chunk := fin.read(8192):
+                    file_hash.update(chunk)
+            _fadvise(fd, 'DONTNEED')
         return file_hash.hexdigest()
     else:
         return None
 
 
-def _sort_files(files: list[Path], sort_by: list[str]) -> list[Path]:
-    files = files[:]
-    for s in sort_by:
-        if s == 'oldest':
-            files = sorted(files, key=lambda x: x.stat().st_ctime)
-        elif s == 'newest':
-            files = sorted(files, key=lambda x: x.stat().st_ctime, reverse=True)
-        elif s == 'lexical':
-            files = sorted(files)
-        elif s == 'highest':
-            files = sorted(files, key=lambda x: len(x.parts))
-        elif s == 'lowest':
-            files = sorted(files, key=lambda x: len(x.parts), reverse=True)
-    return files
+def _sort_files(files: list[FileRecord], sort_by: list[str]) -> list[FileRecord]:
+    """
+    Sort by all criteria at once. The last criterion takes precedence and earlier ones break ties,
+    just as if the files were stably sorted by each criterion in turn.
+    """
+    keys = {
+        'oldest': lambda x: x.ctime,
+        'newest': lambda x: -x.ctime,
+        'lexical': lambda x: x.path.parts,
+        'highest': lambda x: x.depth,
+        'lowest': lambda x: -x.depth,
+    }
+    key_fns = [keys[s] for s in reversed(sort_by)]
+    return sorted(files, key=lambda x: tuple(k(x) for k in key_fns))
 
 
 def _link_dup(dup: tuple[str, list[Path]], dry_run: bool = True, hard=False) -> None:
@@ -84,13 +459,16 @@ def _link_dup(dup: tuple[str, list[Path]], dry_run: bool = True, hard=False) ->
     others = dup[1][1:]
     for p in others:
         principal_relpath = os.path.relpath(principal, p.parent)
-        logging.info(f'ln -f{"" if hard else "s"} "{principal_relpath}" "{str(p)}" {"(dryrun)" if dry_run else ""}')
+        action_logger.info(
+            f'ln -f{"" if hard else "s"} "{principal_relpath}" "{str(p)}" {"(dryrun)" if dry_run else ""}'
+        )
         if dry_run:
             continue
         else:
             p.unlink()
             if hard:
-                p.hardlink_to(principal_relpath)
+                # unlike symlink targets, hardlink targets are resolved relative to the working directory
+                p.hardlink_to(principal)
             else:
                 p.symlink_to(principal_relpath)
 
@@ -98,40 +476,438 @@ def _link_dup(dup: tuple[str, list[Path]], dry_run: bool = True, hard=False) ->
 def _delete_dup(dup: tuple[str, list[Path]], dry_run: bool = True) -> None:
     others = dup[1][1:]
     for p in others:
-        logging.info(f'rm {str(p)}')
+        action_logger.info(f'rm {str(p)}')
         if dry_run:
             continue
         p.unlink()
 
 
-def _find_dups(p: Path, sort_by: list[str], all_: bool) -> dict[str, list[Path]]:
-    ret = {}
-    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
-        pps = list(p.rglob('*'))
-        hashes = executor.map(_get_hash_if_file, pps)
-        for pp, hash_ in zip(pps, hashes):
+def _walk(p: Path, all_: bool) -> Iterator[FileRecord]:
+    """
+    Lazily yield records of all regular files below `p`, in the same order as `Path.rglob`.
+    Unless `all_`, files and directories prefixed with a dot are skipped without descending into them.
+    """
+    stack = [(str(p), len(p.parts) + 1)]
+    while stack:
+        subdirs = []
+        top, depth = stack.pop()
+        try:
+            it = os.scandir(top)
+        except OSError as e:
+            logging.warning(f'Skipping unreadable directory: {e}')
+            continue
+        with it:
+            for entry in it:
+                if not all_ and entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append((entry.path, depth + 1))
+                        continue
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    # removed between listing the directory and looking at the entry
+                    continue
+                yield FileRecord.from_stat(Path(entry.path), st, depth)
+        stack.extend(reversed(subdirs))
+
+
+def _hash_batch(jobs: list[tuple[str, Path]], io_mode: str = 'readinto', algo: str = 'blake2b') -> list[str | None]:
+    ret = []
+    for kind, p in jobs:
+        try:
+            if kind == 'partial':
+                ret.append(_get_partial_hash(p, algo=algo))
+            else:
+                ret.append(_get_hash_if_file(p, io_mode=io_mode, algo=algo))
+        except OSError as e:
+            logging.warning(f'Skipping unreadable file: {e}')
+            ret.append(None)
+    return ret
+
+
+class HashScheduler:
+    """
+    Hands hashing jobs to an executor in batches of up to `batch_size` files or `batch_bytes` bytes,
+    keeping no more than `max_in_flight` batches queued at any time. Jobs are skipped if their hash is cached,
+    or recorded for the unchanged file by the `index` of an incremental run.
+    """
+
+    def __init__(
+        self,
+        executor,
+        max_in_flight: int,
+        cache: HashCache | None = None,
+        io_mode: str = 'readinto',
+        algo: str = 'blake2b',
+        index: DupIndex | None = None,
+        batch_size: int = BATCH_SIZE,
+        batch_bytes: int = BATCH_BYTES,
+    ) -> None:
+        self._executor = executor
+        self._max_in_flight = max_in_flight
+        self._cache = cache
+        self._index = index
+        self._io_mode = io_mode
+        self._algo = algo
+        self._batch_size = batch_size
+        self._batch_bytes = batch_bytes
+        self._batch = []
+        self._batch_nbytes = 0
+        self._in_flight = {}
+        self._results = {}
+
+    def submit(self, f: FileRecord, full: bool = False) -> None:
+        """
+        Schedule hashing of a file.
+        Unless `full`, only head and tail of files are hashed which are large enough for this to make a difference.
+        """
+        if full or f.size <= 2 * PARTIAL_HASH_SIZE:
+            kind, nbytes = 'full', f.size
+        else:
+            kind, nbytes = 'partial', 2 * PARTIAL_HASH_SIZE
+        if self._index is not None and (hash_ := self._index.get(f, kind)) is not None:
+            self._results[f.path] = (kind, hash_)
+            return
+        if self._cache is not None and (hash_ := self._cache.get(f, kind)) is not None:
+            self._results[f.path] = (kind, hash_)
+            return
+        self._batch.append((kind, f.path))
+        self._batch_nbytes += nbytes
+        if len(self._batch) >= self._batch_size or self._batch_nbytes >= self._batch_bytes:
+            self.flush()
+
+    def flush(self) -> None:
+        """Submit the current batch, blocking until there is room for it."""
+        if not self._batch:
+            return
+        while len(self._in_flight) >= self._max_in_flight:
+            self._collect()
+        self._in_flight[self._executor.submit(_hash_batch, self._batch, self._io_mode, self._algo)] = self._batch
+        self._batch = []
+        self._batch_nbytes = 0
+
+    def _collect(self) -> None:
+        done, _ = wait(self._in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            jobs = self._in_flight.pop(future)
+            for (kind, pp), hash_ in zip(jobs, future.result()):
+                self._results[pp] = (kind, hash_)
+
+    def result(self, pp: Path) -> tuple[str, str | None]:
+        """Wait for the hash of a submitted file, and return it along with the kind of hash it is."""
+        if pp not in self._results:
+            self.flush()
+        while pp not in self._results:
+            self._collect()
+        return self._results.pop(pp)
+
+
+def _split_by_hash(
+    groups: list[list[FileRecord]],
+    scheduler: HashScheduler,
+    cache: HashCache | None = None,
+    index: DupIndex | None = None,
+) -> Iterator[tuple[str, str, list[FileRecord]]]:
+    """Split each group of candidate files further by their hashes, yielding only sub-groups with collisions."""
+    for group in groups:
+        by_hash = {}
+        for f in group:
+            kind, hash_ = scheduler.result(f.path)
             if hash_ is None:
                 continue
-            if not all_ and any(x.startswith('.') for x in pp.parts):
-                continue
-            ret.setdefault(hash_, []).append(pp)
-    ret = {k: _sort_files(v, sort_by=sort_by) for k, v in ret.items() if len(v) > 1}
+            if cache is not None:
+                cache.put(f, kind, hash_)
+            if index is not None:
+                index.put(f, kind, hash_)
+            by_hash.setdefault((kind, hash_), []).append(f)
+        yield from ((kind, hash_, v) for (kind, hash_), v in by_hash.items() if len(v) > 1)
+
+
+def _get_roots(dirs: list[str]) -> list[Path]:
+    """Drop repeated directories and directories nested inside others, so that no file is walked twice."""
+    absolute = [Path(d).absolute() for d in dirs]
+    ret = []
+    for i, (d, a) in enumerate(zip(dirs, absolute)):
+        if a in absolute[:i]:
+            continue
+        if any(a != b and a.is_relative_to(b) for b in absolute):
+            logging.warning(f'Skipping directory contained in another one: {d}')
+            continue
+        ret.append(Path(d))
     return ret
 
 
-def _resolve_dups(dups: dict[str, list[Path]], method: str, dry_run: bool = True) -> None:
+def _find_dups(
+    roots: list[Path],
+    sort_by: list[str],
+    all_: bool,
+    cache: HashCache | None = None,
+    workers: int | None = None,
+    backend: str = 'process',
+    io_mode: str = 'readinto',
+    algo: str = 'blake2b',
+    index: DupIndex | None = None,
+    stats: RunStats | None = None,
+) -> Iterator[tuple[str, list[FileRecord]]]:
+    """
+    Lazily yield groups of files with identical content below any of `roots`, each sorted by `sort_by`.
+    If an `index` is passed, only groups involving files which changed since the last run are yielded.
+    """
+    workers = workers or os.cpu_count()
+    executor_cls = {'process': ProcessPoolExecutor, 'thread': ThreadPoolExecutor}[backend]
+    by_size = {}
+    changed_sizes = set()
+    changed_paths = set()
+    active_sizes = set()
+    stats = stats if stats is not None else RunStats()
+    with executor_cls(max_workers=workers) as executor:
+        scheduler = HashScheduler(
+            executor, max_in_flight=2 * workers, cache=cache, io_mode=io_mode, algo=algo, index=index
+        )
+        # only files sharing their size with a (changed) file can be duplicates: start hashing as soon as
+        # a second file of a given size turns up, while the walk is still going on.
+        start = time.perf_counter()
+        for root in roots:
+            for f in _walk(root, all_):
+                stats.files_walked += 1
+                stats.bytes_walked += f.size
+                group = by_size.setdefault(f.size, [])
+                group.append(f)
+                if index is None or index.changed(f, root):
+                    changed_sizes.add(f.size)
+                    if index is not None:
+                        changed_paths.add(f.path)
+                if f.size in active_sizes:
+                    scheduler.submit(f)
+                elif len(group) > 1 and f.size in changed_sizes:
+                    active_sizes.add(f.size)
+                    for ff in group:
+                        scheduler.submit(ff)
+        candidates = [by_size[k] for k in active_sizes]
+        del by_size
+        stats.walk_time += time.perf_counter() - start
+
+        def _is_wanted(group: list[FileRecord]) -> bool:
+            return index is None or any(f.path in changed_paths for f in group)
+
+        partial = []
+        for kind, hash_, group in _split_by_hash(candidates, scheduler, cache, index):
+            if kind == 'partial':
+                partial.append(group)
+            elif _is_wanted(group):
+                yield hash_, _sort_files(group, sort_by=sort_by)
+        # head and tail collide: only now read the whole files, largest first so that
+        # no single huge file is left to be hashed by one worker once all others are done
+        for f in sorted((f for group in partial for f in group), key=lambda x: x.size, reverse=True):
+            scheduler.submit(f, full=True)
+        scheduler.flush()
+        for _, hash_, group in _split_by_hash(partial, scheduler, cache, index):
+            if _is_wanted(group):
+                yield hash_, _sort_files(group, sort_by=sort_by)
+
+
+def _verify_dup(dup: tuple[str, list[Path]]) -> tuple[str, list[Path]]:
+    """Drop all files from a group of duplicates which do not actually have the same content as the principal."""
+    principal = dup[1][0]
+    others = []
+    for p in dup[1][1:]:
+        if filecmp.cmp(principal, p, shallow=False):
+            others.append(p)
+        else:
+            logging.warning(f'Skipping hash collision: "{str(p)}" differs from "{str(principal)}"')
+    return dup[0], [principal, *others]
+
+
+def _resolve_dup(dup: tuple[str, list[Path]], method: str, dry_run: bool = True) -> None:
     methmap = {
         'symlink': lambda dup, dry_run: _link_dup(dup, dry_run=dry_run, hard=False),
         'hardlink': lambda dup, dry_run: _link_dup(dup, dry_run=dry_run, hard=True),
         'delete': _delete_dup,
     }
-    [methmap[method](dup=x, dry_run=dry_run) for x in dups.items()]
+    methmap[method](dup=dup, dry_run=dry_run)
+
+
+class DupReport:
+    """Writes groups of duplicates to a stream as they come in, either as JSON lines or as TSV."""
+
+    def __init__(self, fmt: str, out=sys.stdout) -> None:
+        self._fmt = fmt
+        self._out = out
+        if fmt == 'tsv':
+            self._writer = csv.writer(out, delimiter='\t', lineterminator='\n')
+            self._writer.writerow(['hash', 'size', 'reclaimable', 'path'])
+
+    def write(self, hash_: str, files: list[FileRecord]) -> None:
+        size = files[0].size
+        if self._fmt == 'json':
+            group = {
+                'hash': hash_,
+                'size': size,
+                'count': len(files),
+                'reclaimable': size * (len(files) - 1),
+                'principal': str(files[0].path),
+                'duplicates': [str(f.path) for f in files[1:]],
+            }
+            self._out.write(json.dumps(group) + '\n')
+        else:
+            self._writer.writerows([hash_, size, 0 if i == 0 else size, str(f.path)] for i, f in enumerate(files))
+
+
+class DupResolver:
+    """
+    Verifies and resolves groups of duplicates, on `jobs` threads if more than one.
+    `on_resolved` is called from the submitting thread with each group that was resolved, in the order of submission.
+    Progress is logged at most every `progress_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        method: str,
+        dry_run: bool = True,
+        verify: bool = False,
+        jobs: int = 1,
+        on_resolved=None,
+        stats: RunStats | None = None,
+        progress_interval: float = PROGRESS_INTERVAL,
+    ) -> None:
+        self._method = method
+        self._dry_run = dry_run
+        self._verify = verify
+        self._executor = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+        self._max_pending = 4 * jobs
+        self._pending = collections.deque()
+        self._on_resolved = on_resolved
+        self.stats = stats if stats is not None else RunStats()
+        self._progress_interval = progress_interval
+        self._last_progress = time.monotonic()
+
+    def __enter__(self) -> 'DupResolver':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def _resolve(self, hash_: str, files: list[FileRecord]) -> tuple[str, list[FileRecord]]:
+        dup = (hash_, [f.path for f in files])
+        if self._verify:
+            dup = _verify_dup(dup)
+            verified = set(dup[1])
+            files = [f for f in files if f.path in verified]
+        if len(files) > 1:
+            _resolve_dup(dup, method=self._method, dry_run=self._dry_run)
+        return hash_, files
+
+    def _finish(self, hash_: str, files: list[FileRecord]) -> None:
+        if len(files) > 1:
+            self.stats.groups += 1
+            self.stats.files_resolved += len(files) - 1
+            self.stats.bytes_reclaimed += files[0].size * (len(files) - 1)
+            if self._on_resolved is not None:
+                self._on_resolved(hash_, files)
+        if time.monotonic() - self._last_progress >= self._progress_interval:
+            self._last_progress = time.monotonic()
+            logging.info(self.stats.progress())
+
+    def submit(self, hash_: str, files: list[FileRecord]) -> None:
+        """Schedule resolution of a group of duplicates, blocking while too many are still pending."""
+        start = time.perf_counter()
+        if self._executor is None:
+            self._finish(*self._resolve(hash_, files))
+        else:
+            self._pending.append(self._executor.submit(self._resolve, hash_, files))
+            while len(self._pending) > self._max_pending:
+                self._finish(*self._pending.popleft().result())
+        self.stats.resolve_time += time.perf_counter() - start
+
+    def close(self) -> None:
+        start = time.perf_counter()
+        while self._pending:
+            self._finish(*self._pending.popleft().result())
+        if self._executor is not None:
+            self._executor.shutdown()
+        self.stats.resolve_time += time.perf_counter() - start
+
+
+def _benchmark(roots: list[Path], all_: bool, io_mode: str = 'readinto') -> None:
+    files = [f.path for root in roots for f in _walk(root, all_)]
+    runs = [(mode, 'blake2b') for mode in ('read', 'readinto', 'mmap')]
+    runs += [(io_mode, algo) for algo, impl in HASH_ALGOS.items() if impl is not None and algo != 'blake2b']
+    for mode, algo in runs:
+        start = time.perf_counter()
+        nbytes = sum(
+            pp.stat().st_size for pp in files if _get_hash_if_file(pp, io_mode=mode, algo=algo) is not None
+        )
+        elapsed = time.perf_counter() - start
+        logging.info(
+            f'{mode}, {algo}: hashed {len(files)} files ({nbytes / 2**20:.1f} MiB) in {elapsed:.3f}s, '
+            f'{nbytes / 2**20 / elapsed:.1f} MiB/s'
+        )
 
 
 def main():
     args = _get_args()
-    dups = _find_dups(Path(args.dir[0]), sort_by=args.pick_principal_by, all_=args.all)
-    _resolve_dups(dups, method=args.method, dry_run=args.dry_run)
+    roots = _get_roots(args.dir)
+    incremental = args.incremental or args.watch is not None
+    if incremental:
+        roots = [root.absolute() for root in roots]
+    if args.benchmark:
+        _benchmark(roots, all_=args.all, io_mode=args.io_mode)
+        return
+    algo = _get_hash_algo(args.hash)
+    if args.quiet:
+        action_logger.setLevel(logging.WARNING)
+    report = DupReport(args.report) if args.report is not None else None
+    while True:
+        if args.no_cache:
+            cache = contextlib.nullcontext()
+        else:
+            cache = HashCache(args.cache_file, rebuild=args.rebuild_cache, algo=algo)
+        if incremental:
+            index = DupIndex(args.index_file, roots, persist=not args.dry_run, algo=algo)
+        else:
+            index = contextlib.nullcontext()
+        stats = RunStats()
+        start = time.perf_counter()
+        with cache as cache, index as index:
+
+            def _on_resolved(hash_: str, files: list[FileRecord]) -> None:
+                if report is not None:
+                    report.write(hash_, files)
+                if index is not None and not args.dry_run:
+                    index.refresh([f.path for f in files[1:]])
+
+            dups = _find_dups(
+                roots,
+                sort_by=args.pick_principal_by,
+                all_=args.all,
+                cache=cache,
+                workers=args.workers,
+                backend=args.backend,
+                io_mode=args.io_mode,
+                algo=algo,
+                index=index,
+                stats=stats,
+            )
+            resolver = DupResolver(
+                args.method,
+                dry_run=args.dry_run,
+                verify=args.verify,
+                jobs=args.resolve_jobs,
+                on_resolved=_on_resolved,
+                stats=stats,
+            )
+            with resolver:
+                for hash_, files in dups:
+                    resolver.submit(hash_, files)
+        stats.hash_time = time.perf_counter() - start - stats.walk_time - stats.resolve_time
+        logging.info(stats.summary())
+        if args.watch is None:
+            break
+        args.rebuild_cache = False
+        time.sleep(args.watch)
 
 
 if __name__ == '__main__':
@@ -4,15 +4,27 @@
 # ///
 
 import argparse
+import hashlib
+import json
 import logging
 import os
 import shutil
+import stat
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Set, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
 
 
 logging.basicConfig(format='%(levelname)s - %(message)s')
 
+MANIFEST_VERSION = 1
+
 
 def get_args():
     parser = argparse.ArgumentParser(
@@ -22,9 +34,16 @@ def get_args():
     subparsers = parser.add_subparsers(dest='op')
     install = subparsers.add_parser('install', help='Install a dotfiles package.')
     uninstall = subparsers.add_parser('uninstall', help='Uninstall a dotfiles package.')
-    for p, op_verb in zip((install, uninstall), ('install', 'uninstall')):
+    status = subparsers.add_parser(
+        'status',
+        help='Report installed dotfiles packages which changed, and links which went missing or were '
+        'modified since, according to the manifest. Exits with 1 if anything drifted.',
+    )
+    for p, op_verb in zip((install, uninstall, status), ('install', 'uninstall', 'check')):
         p.add_argument(
             'pkg',
+            nargs='?' if p is status else None,
+            default='all',
             help=f'The dotfiles package name to {op_verb}. If "all", {op_verb} all dotfiles packages instead.',
         )
         p.add_argument(
@@ -37,12 +56,33 @@ def get_args():
         p.add_argument(
             '-v', '--verbose', default=False, action='store_true', help='Toggle verbosity.'
         )
+        p.add_argument(
+            '--dotfiles_dir',
+            metavar='PATH',
+            default=str(Path.home() / '.dotfiles'),
+            help='The directory containing the dotfiles packages.',
+        )
+        p.add_argument(
+            '--profile',
+            default=False,
+            action='store_true',
+            help='Report the time spent per phase, the file system calls by type and the slowest packages to stderr.',
+        )
+        p.add_argument(
+            '--manifest',
+            metavar='PATH',
+            default=str(Path(os.environ.get('XDG_STATE_HOME') or Path.home() / '.local/state') / 'stow/manifest.json'),
+            help='The file recording the installed links of each dotfiles package.',
+        )
+        if p is status:
+            p.set_defaults(dry_run=True, shove=False, jobs=1, force=False)
+            continue
         p.add_argument(
             '-d',
             '--dry-run',
             default=False,
             action='store_true',
-            help='Whether to simulate changes. No file system changes will occur.',
+            help='Print the planned changes instead of applying them. No file system changes will occur.',
         )
         p.add_argument(
             '-s',
@@ -53,14 +93,167 @@ def get_args():
             'when introducing symlinks (instead of throwing an error)',
         )
         p.add_argument(
-            '--dotfiles_dir',
-            metavar='PATH',
-            default=str(Path.home() / '.dotfiles'),
-            help='The directory containing the dotfiles packages.',
+            '-j',
+            '--jobs',
+            type=int,
+            default=1,
+            help='The number of packages to plan and apply concurrently when operating on "all".',
+        )
+        p.add_argument(
+            '-f',
+            '--force',
+            default=False,
+            action='store_true',
+            help='Walk the dotfiles package even if the manifest shows it unchanged since it was installed.',
         )
     return parser.parse_args()
 
 
+@dataclass(frozen=True)
+class Action:
+    """
+    A single file system change planned by `Stow`, printed in shell notation.
+
+    :param op: 'mkdir', 'mv', 'ln' or 'rm', or 'keep' for a link which is already in place
+    :param dst: the path to create, move to, link or remove
+    :param src: the path to move, or the target of the link
+    """
+
+    op: str
+    dst: Path
+    src: Optional[Path] = None
+
+    def __str__(self) -> str:
+        if self.op == 'mkdir':
+            return f'mkdir {self.dst}'
+        elif self.op == 'mv':
+            return f'mv {self.src} {self.dst}'
+        elif self.op == 'ln':
+            return f'ln -s {self.src} {self.dst}'
+        elif self.op == 'keep':
+            return f'# keep {self.dst} -> {self.src}'
+        return f'rm {self.dst}'
+
+    def apply(self):
+        if self.op == 'mkdir':
+            self.dst.mkdir()
+        elif self.op == 'mv':
+            shutil.move(src=self.src, dst=self.dst)
+        elif self.op == 'ln':
+            self.dst.symlink_to(self.src)
+        elif self.op == 'rm':
+            self.dst.unlink()
+
+
+class PathTrie:
+    """
+    A set of absolute paths, stored by their components, to find whether a path or any of its
+    ancestors is in the set in O(depth).
+    """
+
+    _END = None
+
+    def __init__(self, paths: Iterable[Path] = ()) -> None:
+        self._root = {}
+        for path in paths:
+            self.add(path)
+
+    def add(self, path: Path):
+        node = self._root
+        for part in Path(path).parts:
+            node = node.setdefault(part, {})
+        node[self._END] = True
+
+    def __contains__(self, path: Path) -> bool:
+        node = self._root
+        for part in Path(path).parts:
+            node = node.get(part)
+            if node is None:
+                return False
+        return self._END in node
+
+    def covers(self, path: Path) -> bool:
+        """Whether the path itself or any of its ancestors is in the set."""
+        node = self._root
+        for part in Path(path).parts:
+            if self._END in node:
+                return True
+            node = node.get(part)
+            if node is None:
+                return False
+        return self._END in node
+
+
+class Profile:
+    """
+    Wall time per phase, file system calls by type and time per package of a `Stow` run.
+    A phase entered within another one pauses the outer phase, so that no time is counted twice.
+    With several jobs, phase times are summed over threads and can exceed the wall time.
+    """
+
+    _NULL = nullcontext()
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._phase_times: Dict[str, float] = defaultdict(float)
+        self._pkg_times: Dict[str, float] = defaultdict(float)
+        self._calls: Counter = Counter()
+
+    def phase(self, name: str):
+        return self._phase(name) if self.enabled else self._NULL
+
+    @contextmanager
+    def _phase(self, name: str):
+        stack = self._local.__dict__.setdefault('stack', [])
+        now = time.perf_counter()
+        if stack:
+            self._add(self._phase_times, stack[-1][0], now - stack[-1][1])
+        stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self._add(self._phase_times, name, now - stack.pop()[1])
+            if stack:
+                stack[-1][1] = now
+
+    def package(self, pkg: str):
+        return self._package(pkg) if self.enabled else self._NULL
+
+    @contextmanager
+    def _package(self, pkg: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(self._pkg_times, pkg, time.perf_counter() - start)
+
+    def _add(self, times: Dict[str, float], key: str, seconds: float):
+        with self._lock:
+            times[key] += seconds
+
+    def count(self, call: str, n: int = 1):
+        if self.enabled:
+            with self._lock:
+                self._calls[call] += n
+
+    def report(self, n_slowest: int = 10):
+        """Print the profile to stderr."""
+        wall = time.perf_counter() - self._start
+        lines = [f'profile: {wall:.3f}s wall, {len(self._pkg_times)} packages', 'phase seconds:']
+        phases = sorted(self._phase_times.items(), key=lambda x: -x[1])
+        lines += [f'  {name:<10}{seconds:9.3f}' for name, seconds in phases]
+        lines.append('file system calls:')
+        lines += [f'  {call:<10}{n:9d}' for call, n in self._calls.most_common()]
+        lines.append('slowest packages (planning and applying, seconds):')
+        slowest = sorted(self._pkg_times.items(), key=lambda x: -x[1])[:n_slowest]
+        lines += [f'  {seconds:9.3f}  {pkg}' for pkg, seconds in slowest]
+        print('\n'.join(lines), file=sys.stderr)
+
+
 class Stow:
     def __init__(
         self,
@@ -70,7 +263,12 @@ class Stow:
         ignore_errors: bool = False,
         relative_base: Path = Path.home(),
         dotfiles_dir: Path = Path.home() / '.dotfiles',
+        jobs: int = 1,
+        manifest: Optional[Path] = None,
+        force: bool = False,
+        profile: bool = False,
     ) -> None:
+        self.profile = Profile(profile)
         self._logger = logging.getLogger('stow')
         self._logger.setLevel((logging.INFO if verbose else logging.WARNING))
         self._dry_run = dry_run
@@ -78,13 +276,67 @@ class Stow:
         self._ignore_errors = ignore_errors
         self._relative_base = relative_base.absolute()
         self._dotfiles_dir = dotfiles_dir
-        self._ignored_paths, self._ensure_present_paths = self._read_ignored_paths(
-            self._dotfiles_dir / '.stowignore'
-        )
+        self._jobs = max(1, jobs)
+        # log lines of the package handled by the current thread, held back to keep their order
+        self._local = threading.local()
+        # per-run caches of lstat results and resolved paths, shared by all planning steps
+        self._lstat_cache: Dict[str, Optional[os.stat_result]] = {}
+        self._resolve_cache: Dict[str, str] = {}
+        # relative paths are resolved against the working directory, which stow never changes
+        self.profile.count('getcwd')
+        self._cwd = os.getcwd()
+        with self.profile.phase('ignore'):
+            ignored_paths, ensure_present_paths = self._read_ignored_paths(
+                self._dotfiles_dir / '.stowignore'
+            )
+            self._ignored_paths = PathTrie(ignored_paths)
+            self._ensure_present_paths = PathTrie(ensure_present_paths)
+            ignore_file = self._dotfiles_dir / '.stowignore'
+            self._config = f'{self._relative_base}\n{ignore_file.read_text() if ignore_file.is_file() else ""}'
+        # installed links of each package under the relative base, as of the last run
+        self._manifest_path = manifest
+        self._force = force
+        self._manifest_lock = threading.Lock()
+        self._manifest_changed = False
+        with self.profile.phase('manifest'):
+            self._manifest = self._read_manifest()
+        self._installs = self._manifest.setdefault(str(self._relative_base), {})
+        self._signatures: Dict[str, str] = {}
+
+    def _log(self, level: Optional[int], msg: str):
+        """Log a message, or print it for level None, unless held back by `_run_buffered`."""
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is not None:
+            buffer.append((level, msg))
+        elif level is None:
+            print(msg)
+        else:
+            self._logger.log(level, msg)
+
+    def _run_buffered(
+        self, fn: Callable, *args, **kwargs
+    ) -> Tuple[Any, Optional[Exception], List[Tuple[Optional[int], str]]]:
+        """Call `fn`, and return its result or exception along with the log lines it held back."""
+        self._local.buffer = []
+        try:
+            return fn(*args, **kwargs), None, self._local.buffer
+        except Exception as e:
+            return None, e, self._local.buffer
+        finally:
+            self._local.buffer = None
+
+    def _flush(self, results: List[Tuple[Any, Optional[Exception], List[Tuple[Optional[int], str]]]]) -> List[Any]:
+        """Emit the held back log lines of `_run_buffered` results in order, and raise any error."""
+        for _, e, buffer in results:
+            for level, msg in buffer:
+                self._log(level, msg)
+            if e is not None:
+                raise e
+        return [result for result, _, _ in results]
 
     def _maybe_raise(self, s: str):
         if self._ignore_errors:
-            self._logger.error(s)
+            self._log(logging.ERROR, s)
         else:
             raise RuntimeError(s)
 
@@ -122,32 +374,176 @@ class Stow:
             )
         return ignored_paths, ensure_present_paths
 
-    def _maybe_shove(self, dst: Path, shove_suffix: str = '.bak') -> bool:
+    def _lstat(self, path: Path) -> Optional[os.stat_result]:
+        key = str(path)
+        if key not in self._lstat_cache:
+            self.profile.count('lstat')
+            with self.profile.phase('resolve'):
+                try:
+                    self._lstat_cache[key] = os.lstat(key)
+                except (FileNotFoundError, NotADirectoryError):
+                    self._lstat_cache[key] = None
+        return self._lstat_cache[key]
+
+    def _resolve_in(self, base: str, path: str, seen: Set[str]) -> str:
+        """
+        Resolve `path` relative to the already resolved directory `base` component by component,
+        so that every directory is only resolved once per run. Like `os.path.realpath`,
+        missing components are kept as they are.
+        """
+        for name in path.split(os.sep):
+            if name in ('', '.'):
+                continue
+            if name == '..':
+                base = os.path.dirname(base)
+                continue
+            key = os.path.join(base, name)
+            resolved = self._resolve_cache.get(key)
+            if resolved is None:
+                st = self._lstat(key)
+                if st is not None and stat.S_ISLNK(st.st_mode) and key not in seen:
+                    self.profile.count('readlink')
+                    target = os.readlink(key)
+                    target_base = os.sep if os.path.isabs(target) else base
+                    resolved = self._resolve_in(target_base, target, seen | {key})
+                else:
+                    resolved = key
+                self._resolve_cache[key] = resolved
+            base = resolved
+        return base
+
+    def _resolve(self, path: Path) -> Path:
+        """Memoised equivalent of `path.resolve().absolute()`."""
+        path = os.path.join(self._cwd, path)
+        with self.profile.phase('resolve'):
+            return Path(self._resolve_in(os.sep, path, set()))
+
+    def _exists(self, path: Path) -> bool:
+        """Memoised equivalent of `path.exists()`."""
+        return self._lstat(self._resolve(path)) is not None
+
+    def _read_manifest(self) -> Dict[str, Dict[str, dict]]:
+        """
+        Read the manifest of installed packages, keyed by relative base and then by package path.
+        A missing or unreadable manifest counts as empty, so that every package is walked.
+        """
+        if self._manifest_path is None or not self._manifest_path.is_file():
+            return {}
+        try:
+            manifest = json.loads(self._manifest_path.read_text())
+        except ValueError:
+            self._log(logging.WARNING, f'Ignoring unreadable manifest: {self._manifest_path}')
+            return {}
+        if manifest.get('version') != MANIFEST_VERSION:
+            self._log(logging.WARNING, f'Ignoring manifest of another version: {self._manifest_path}')
+            return {}
+        return manifest['installs']
+
+    def save_manifest(self):
+        """Write the manifest, if anything was installed or uninstalled, replacing it atomically."""
+        if self._manifest_path is None or self._dry_run or not self._manifest_changed:
+            return
+        installs = {base: pkgs for base, pkgs in self._manifest.items() if pkgs}
+        with self.profile.phase('manifest'):
+            self._manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._manifest_path.with_name(self._manifest_path.name + '.tmp')
+            tmp_path.write_text(json.dumps({'version': MANIFEST_VERSION, 'installs': installs}, indent=1) + '\n')
+            os.replace(tmp_path, self._manifest_path)
+        self._manifest_changed = False
+
+    def _pkg_key(self, pkg: str) -> str:
+        return str((self._dotfiles_dir / pkg).absolute())
+
+    def _hash_tree(self, path: Path, pkg_path: Path, digest: Any):
+        self.profile.count('scandir')
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda x: x.name)
+        for entry in entries:
+            src = Path(entry.path)
+            if entry.is_file():
+                kind = 'f'
+            elif not entry.is_dir():
+                kind = '?'
+            elif self._resolve(self._relative_base / src.relative_to(pkg_path)) in self._ensure_present_paths:
+                kind = 'D'
+            else:
+                kind = 'd'
+            digest.update(f'{kind} {src.relative_to(pkg_path)}\n'.encode())
+            if kind == 'D':
+                self._hash_tree(src, pkg_path, digest)
+
+    def _signature(self, pkg_path: Path) -> str:
         """
-        Move an existing file or directory out of the way to make space for the
+        Hash the part of the package tree which decides its links: the names and kinds of the
+        entries, descending only into essential directories as the planning does, along with the
+        relative base and the ignore file. File contents do not change any link, so they are not read.
+        """
+        digest = hashlib.sha256(self._config.encode())
+        with self.profile.phase('walk'):
+            self._hash_tree(pkg_path, pkg_path, digest)
+        return digest.hexdigest()
+
+    def _is_recorded(self, link: Dict[str, str]) -> bool:
+        """Whether a link of the manifest is still in place, checked by reading the link only."""
+        self.profile.count('readlink')
+        try:
+            with self.profile.phase('resolve'):
+                return os.readlink(link['dst']) == link['target']
+        except OSError:
+            return False
+
+    def _record(self, pkg: str, op: str, plan: List[Action]):
+        """Update the manifest entry of a package after its plan was applied."""
+        if self._manifest_path is None or self._dry_run:
+            return
+        key = self._pkg_key(pkg)
+        installed = None
+        if op == 'install':
+            installed = {
+                'signature': self._signatures[key],
+                'links': [
+                    {
+                        'src': os.path.normpath(x.dst.parent / x.src),
+                        'dst': str(x.dst),
+                        'target': str(x.src),
+                    }
+                    for x in plan
+                    if x.op in ('ln', 'keep')
+                ],
+            }
+        with self._manifest_lock:
+            if self._installs.get(key) == installed:
+                return
+            self._manifest_changed = True
+            if installed is None:
+                del self._installs[key]
+            else:
+                self._installs[key] = installed
+
+    def _plan_shove(self, dst: Path, plan: List[Action], shove_suffix: str = '.bak') -> bool:
+        """
+        Plan to move an existing file or directory out of the way to make space for the
         to-be-introduced symlink into the dotfiles.
         Fail if the target already exists.
         """
-        dst = str(dst.absolute())
-        dst_shoved = dst + shove_suffix
-        if Path(dst_shoved).exists():
+        dst = dst.absolute()
+        dst_shoved = Path(str(dst) + shove_suffix)
+        if self._exists(dst_shoved):
             self._maybe_raise(f'Cannot shove destination out of the way: {dst_shoved} exists')
             return False
-        else:
-            self._logger.info(f'mv {dst} {dst_shoved}')
-            if not self._dry_run:
-                shutil.move(src=dst, dst=dst_shoved)
-            return True
+        plan.append(Action('mv', dst=dst_shoved, src=dst))
+        return True
 
-    def _maybe_lns_relatively(self, src: Path, dst: Path):
+    def _plan_lns_relatively(self, src: Path, dst: Path, plan: List[Action]):
         """
-        If the target does not yet exist, create a symlink from
+        If the target does not yet exist, plan a symlink from
         the dotfiles dir to the destination. This will skip over
         already installed files but will raise upon finding a link
         which does not point to the dotfiles dir.
 
         :param src: the path in the dotfiles dir
         :param dst: the path in the target destination
+        :param plan: the list of actions to append to
         """
         commonpath = Path(os.path.commonpath([src, dst]))
         n_above_dst = list(dst.parents).index(commonpath)
@@ -155,116 +551,184 @@ class Stow:
         src_without_relhead = '/'.join(src.parts[len(commonpath.parts) :])
         src_relpath = Path(dst_dots) / src_without_relhead
 
-        if dst.exists():
-            if dst.resolve().absolute() == src.resolve().absolute():
-                self._logger.warning(f'Skipping already managed destination: {dst}')
-                return
-            else:
-                if dst.is_file() or dst.is_dir() or dst.is_symlink():
-                    if self._shove:
-                        if self._maybe_shove(dst):
-                            self._logger.info(f'ln -s {src_relpath} {dst}')
-                            if not self._dry_run:
-                                dst.symlink_to(src_relpath)
-                        else:
-                            return
-                    else:
-                        self._maybe_raise(f'Destination already exists but is not managed: {dst}')
-                else:
-                    self._maybe_raise(
-                        f'Destination already exists but is not a file, dir or symlink: {dst}'
-                    )
-        else:
-            self._logger.info(f'ln -s {src_relpath} {dst}')
-            if not self._dry_run:
-                dst.symlink_to(src_relpath)
+        # lstat, so that dangling symlinks count as existing destinations
+        dst_stat = self._lstat(dst)
+        if dst_stat is None:
+            plan.append(Action('ln', dst=dst, src=src_relpath))
+        elif self._resolve(dst) == self._resolve(src):
+            self._log(logging.WARNING, f'Skipping already managed destination: {dst}')
+            if stat.S_ISLNK(dst_stat.st_mode):
+                self.profile.count('readlink')
+                plan.append(Action('keep', dst=dst, src=Path(os.readlink(dst))))
+        elif not (
+            stat.S_ISREG(dst_stat.st_mode)
+            or stat.S_ISDIR(dst_stat.st_mode)
+            or stat.S_ISLNK(dst_stat.st_mode)
+        ):
+            self._maybe_raise(f'Destination already exists but is not a file, dir or symlink: {dst}')
+        elif not self._shove:
+            self._maybe_raise(f'Destination already exists but is not managed: {dst}')
+        elif self._plan_shove(dst, plan):
+            plan.append(Action('ln', dst=dst, src=src_relpath))
 
-    def _maybe_rmlink(self, src: Path, dst: Path):
+    def _plan_rmlink(self, src: Path, dst: Path, plan: List[Action]):
         """
-        If the target exists and points to the dotfiles dir, remove that link.
+        If the target exists and points to the dotfiles dir, plan to remove that link.
         This will ignore already missing links, but will raise upon finding a link
         which does not point to the dotfiles dir.
 
         :param src: the path in the dotfiles dir
         :param dst: the path in the target destination
+        :param plan: the list of actions to append to
         """
-        if dst.exists():
-            if dst.resolve().absolute() == src.absolute():
-                self._logger.info(f'rm {dst}')
-                if not self._dry_run:
-                    dst.unlink()
-            else:
-                self._maybe_raise(
-                    f'Destination doesn\'t link to dotfiles: {dst} -> {dst.resolve()}'
-                )
+        if not self._exists(dst):
+            self._log(logging.WARNING, f'Skipping non-existing destination: {dst}')
+        elif self._resolve(dst) == src.absolute():
+            plan.append(Action('rm', dst=dst))
         else:
-            self._logger.warning(f'Skipping non-existing destination: {dst}')
+            self._maybe_raise(f'Destination doesn\'t link to dotfiles: {dst} -> {self._resolve(dst)}')
 
-    def _perform_op(self, src: Path, dst: Path, op: str):
+    def _plan_op(self, src: Path, dst: Path, op: str, plan: List[Action]):
         """
-        Attempt to install or remove a symlink.
+        Plan to install or remove a symlink.
 
         :param src: the path in the dotfiles dir
         :param dst: the path in the target destination
         :param op: 'install' or 'uninstall'
+        :param plan: the list of actions to append to
         """
-        if src.resolve().absolute() in self._ignored_paths:
-            self._logger.warning(f'Skipping ignored destination: {dst}')
+        if self._ignored_paths.covers(self._resolve(src)):
+            self._log(logging.WARNING, f'Skipping ignored destination: {dst}')
             return
         if op == 'install':
-            self._maybe_lns_relatively(src=src, dst=dst)
+            self._plan_lns_relatively(src=src, dst=dst, plan=plan)
         elif op == 'uninstall':
-            self._maybe_rmlink(src=src, dst=dst)
-
-    def _maybe_mkdir(self, dst: Path):
-        """
-        Create a directory if it doesn't exist.
-
-        :param dst: the directory to ensure it exists.
-        """
-        if not dst.exists():
-            self._logger.info(f'mkdir {dst}')
-            if not self._dry_run:
-                dst.mkdir()
+            self._plan_rmlink(src=src, dst=dst, plan=plan)
 
-    def _operate_path_recursively(self, src: Path, pkg_path: Path, op: str):
+    def _plan_path_recursively(
+        self, entry: os.DirEntry, pkg_path: Path, op: str, plan: List[Action]
+    ):
         """
-        Walk the tree of the passed source path until encountering either a file,
+        Walk the tree of the passed source entry until encountering either a file,
         or a directory which is not an essential directory
         (which are automatically and silently created).
-        Perform the desired operation on that path.
+        Plan the desired operation on that path.
 
-        :param src: the path in the dotfiles dir
-        :param dst: the path in the target destination
+        :param entry: the scandir entry of the path in the dotfiles dir
+        :param pkg_path: the dotfiles package the entry belongs to
         :param op: 'install' or 'uninstall'
+        :param plan: the list of actions to append to
         """
+        src = Path(entry.path)
         dst = self._relative_base / src.relative_to(pkg_path)
-        if src.is_file():
-            self._perform_op(src, dst, op=op)
-        elif src.is_dir():
-            if dst.resolve().absolute() in self._ensure_present_paths:
-                if op == 'install':
-                    self._maybe_mkdir(dst)
-                for component in src.iterdir():
-                    self._operate_path_recursively(component, pkg_path, op=op)
+        if entry.is_file():
+            self._plan_op(src, dst, op=op, plan=plan)
+        elif entry.is_dir():
+            if self._resolve(dst) in self._ensure_present_paths:
+                if op == 'install' and not self._exists(dst):
+                    plan.append(Action('mkdir', dst=dst))
+                self.profile.count('scandir')
+                with os.scandir(src) as it:
+                    for child in it:
+                        self._plan_path_recursively(child, pkg_path, op=op, plan=plan)
             else:
-                self._perform_op(src, dst, op=op)
+                self._plan_op(src, dst, op=op, plan=plan)
 
-    def operate_pkg(self, pkg: str, op: str):
+    def plan_pkg(self, pkg: str, op: str) -> List[Action]:
         """
-        Perform the desired operation on the dotfiles package with the given name.
+        Plan the desired operation on the dotfiles package with the given name, without
+        changing the file system.
 
         :param pkg: The directory name of the dotfiles package to operate on.
         :param op: 'install' or 'uninstall'
+        :returns: The actions to apply, in order.
         """
+        with self.profile.package(pkg), self.profile.phase('walk'):
+            return self._plan_pkg(pkg, op)
+
+    def _plan_pkg(self, pkg: str, op: str) -> List[Action]:
         pkg_path = self._dotfiles_dir / pkg
+        key = self._pkg_key(pkg)
+        self.profile.count('stat')
         if not pkg_path.is_dir():
+            if op == 'uninstall' and key in self._installs:
+                # the package is gone, but the manifest still knows its links
+                self._log(logging.INFO, f'Uninstalling removed {pkg_path} relative to {self._relative_base}')
+                return self._plan_rm_recorded(self._installs[key])
             raise RuntimeError(f'Dotfiles package not found: {pkg_path}')
 
         op_verb = op.title() + 'ing'
-        self._logger.info(f'{op_verb} {pkg_path} relative to {self._relative_base}')
-        for component in pkg_path.iterdir():
-            self._operate_path_recursively(component, pkg_path, op=op)
+        self._log(logging.INFO, f'{op_verb} {pkg_path} relative to {self._relative_base}')
+        self._signatures[key] = self._signature(pkg_path)
+        installed = self._installs.get(key)
+        if installed is not None and installed['signature'] == self._signatures[key] and not self._force:
+            if op == 'install' and all(self._is_recorded(x) for x in installed['links']):
+                self._log(logging.INFO, f'Skipping unchanged package: {pkg_path}')
+                return [Action('keep', dst=Path(x['dst']), src=Path(x['target'])) for x in installed['links']]
+            if op == 'uninstall':
+                return self._plan_rm_recorded(installed)
+
+        plan = []
+        self.profile.count('scandir')
+        with os.scandir(pkg_path) as it:
+            for entry in it:
+                self._plan_path_recursively(entry, pkg_path, op=op, plan=plan)
+        if installed is not None:
+            # links of files which were removed from the package since it was installed
+            planned = {x.dst for x in plan if x.op != 'mkdir'}
+            stale = [x for x in installed['links'] if Path(x['dst']) not in planned and self._is_recorded(x)]
+            plan = [Action('rm', dst=Path(x['dst'])) for x in stale] + plan
+        return plan
+
+    def _plan_rm_recorded(self, installed: Dict[str, Any]) -> List[Action]:
+        """Plan to remove the links of a manifest entry, without walking the package."""
+        plan = []
+        for link in installed['links']:
+            dst = Path(link['dst'])
+            if self._lstat(dst) is None:
+                self._log(logging.WARNING, f'Skipping non-existing destination: {dst}')
+            elif self._is_recorded(link):
+                plan.append(Action('rm', dst=dst))
+            else:
+                self._maybe_raise(f'Destination doesn\'t link to dotfiles: {dst} -> {self._resolve(dst)}')
+        return plan
+
+    def apply(self, plan: List[Action]):
+        """
+        Apply planned actions in order. In a dry run, print them instead.
+
+        :param plan: The actions to apply.
+        """
+        for action in plan:
+            if action.op == 'keep':
+                continue
+            if self._dry_run:
+                self._log(None, str(action))
+            else:
+                self._log(logging.INFO, str(action))
+                self.profile.count(action.op)
+                with self.profile.phase('mutate'):
+                    action.apply()
+        # the file system changed under the caches
+        self._lstat_cache.clear()
+        self._resolve_cache.clear()
+
+    def operate_pkg(self, pkg: str, op: str):
+        """
+        Perform the desired operation on the dotfiles package with the given name.
+
+        :param pkg: The directory name of the dotfiles package to operate on.
+        :param op: 'install' or 'uninstall'
+        """
+        try:
+            self._apply_pkg(pkg, self.plan_pkg(pkg, op=op), op=op)
+        finally:
+            self.save_manifest()
+
+    def _apply_pkg(self, pkg: str, plan: List[Action], op: str):
+        with self.profile.package(pkg):
+            self.apply(plan)
+        self._record(pkg, op, plan)
 
     def get_all_pkgs(self):
         """
@@ -272,23 +736,119 @@ class Stow:
 
         :returns: A list of dotfiles package names in the dotfiles dir.
         """
-        all_pkgs = [
-            x.name
-            for x in self._dotfiles_dir.iterdir()
-            if x.is_dir()
-            and (self._dotfiles_dir / x).resolve().absolute() not in self._ignored_paths
-        ]
+        self.profile.count('scandir')
+        with self.profile.phase('walk'), os.scandir(self._dotfiles_dir) as it:
+            all_pkgs = [
+                x.name
+                for x in it
+                if x.is_dir() and not self._ignored_paths.covers(self._resolve(Path(x.path)))
+            ]
         return all_pkgs
 
     def operate_all_pkg(self, op: str):
         """
         Perform the desired operation on all dotfile packages apart from those explicitly
-        excluded by the stowignore file.
+        excluded by the stowignore file. All packages are planned before any is changed.
 
         :param op: 'install' or 'uninstall'
         """
-        for pkg in self.get_all_pkgs():
-            self.operate_pkg(pkg, op=op)
+        pkgs = self.get_all_pkgs()
+        try:
+            with ThreadPoolExecutor(self._jobs) as pool:
+                plans = self._flush(
+                    list(pool.map(lambda pkg: self._run_buffered(self.plan_pkg, pkg, op=op), pkgs))
+                )
+                independent, conflicting = self._split_conflicts(pkgs, plans)
+
+                # shared essential directories are created once, before the packages linking into them
+                mkdirs = {}
+                for plan in independent.values():
+                    mkdirs.update((action.dst, action) for action in plan if action.op == 'mkdir')
+                self.apply(list(mkdirs.values()))
+                rest = [(pkg, [x for x in plan if x.op != 'mkdir']) for pkg, plan in independent.items()]
+                self._flush(
+                    list(pool.map(lambda x: self._run_buffered(self._apply_pkg, *x, op=op), rest))
+                )
+
+            # packages sharing destinations with an earlier one are replanned after it was applied
+            for pkg in conflicting:
+                self._apply_pkg(pkg, self.plan_pkg(pkg, op=op), op=op)
+        finally:
+            self.save_manifest()
+
+    def status(self, pkg: str) -> bool:
+        """
+        Print the drift of installed packages from the manifest: packages which changed or were
+        removed since they were installed, and their links which are missing or point elsewhere.
+        Only the recorded links are read, the destination directories are not walked.
+
+        :param pkg: The directory name of the dotfiles package to check, or "all".
+        :returns: Whether anything drifted.
+        """
+        if pkg == 'all':
+            pkgs = self.get_all_pkgs()
+            dotfiles_dir = str(self._dotfiles_dir.absolute())
+            pkgs += sorted(
+                os.path.basename(x)
+                for x in self._installs
+                if os.path.dirname(x) == dotfiles_dir and os.path.basename(x) not in pkgs
+            )
+        else:
+            pkgs = [pkg]
+
+        drifted = False
+        for pkg in pkgs:
+            with self.profile.package(pkg):
+                drifted |= self._status_pkg(pkg)
+        return drifted
+
+    def _status_pkg(self, pkg: str) -> bool:
+        pkg_path = self._dotfiles_dir / pkg
+        installed = self._installs.get(self._pkg_key(pkg))
+        if installed is None:
+            self._log(logging.INFO, f'not installed\t{pkg_path}')
+            return False
+        problems = []
+        self.profile.count('stat')
+        if not pkg_path.is_dir():
+            problems.append(f'removed\t{pkg_path}')
+        elif self._signature(pkg_path) != installed['signature']:
+            problems.append(f'changed\t{pkg_path}')
+        for link in installed['links']:
+            if self._lstat(Path(link['dst'])) is None:
+                problems.append(f'missing\t{link["dst"]}')
+            elif not self._is_recorded(link):
+                problems.append(f'modified\t{link["dst"]}')
+        for problem in problems:
+            self._log(None, problem)
+        if not problems:
+            self._log(logging.INFO, f'ok\t{pkg_path}')
+        return bool(problems)
+
+    @staticmethod
+    def _split_conflicts(
+        pkgs: List[str], plans: List[List[Action]]
+    ) -> Tuple[Dict[str, List[Action]], List[str]]:
+        """
+        Split planned packages into those which change disjoint destinations, and those which
+        change a destination, or a path above or below it, of an earlier package.
+        Creating the same directory does not count as a conflict.
+        """
+        claimed = PathTrie()
+        claimed_paths = []
+        independent = {}
+        conflicting = []
+        for pkg, plan in zip(pkgs, plans):
+            paths = [x.dst for x in plan if x.op != 'mkdir'] + [x.src for x in plan if x.op == 'mv']
+            own = PathTrie(paths)
+            if any(claimed.covers(x) for x in paths) or any(own.covers(x) for x in claimed_paths):
+                conflicting.append(pkg)
+                continue
+            independent[pkg] = plan
+            for path in paths:
+                claimed.add(path)
+            claimed_paths.extend(paths)
+        return independent, conflicting
 
 
 if __name__ == '__main__':
@@ -299,8 +859,18 @@ if __name__ == '__main__':
         shove=args.shove,
         relative_base=Path(args.relative_base),
         dotfiles_dir=Path(args.dotfiles_dir),
+        jobs=args.jobs,
+        manifest=Path(args.manifest),
+        force=args.force,
+        profile=args.profile,
     )
-    if args.pkg == 'all':
-        stow.operate_all_pkg(op=args.op)
-    else:
-        stow.operate_pkg(args.pkg, op=args.op)
+    try:
+        if args.op == 'status':
+            sys.exit(1 if stow.status(args.pkg) else 0)
+        elif args.pkg == 'all':
+            stow.operate_all_pkg(op=args.op)
+        else:
+            stow.operate_pkg(args.pkg, op=args.op)
+    finally:
+        if args.profile:
+            stow.profile.report()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Benchmark and regression harness for col-stats.py.
+
+Generates synthetic TSVs of the requested shapes, runs col-stats.py on them in a subprocess per
+backend variant, and reports wall time and peak RSS. Every variant is checked against the exact
+pure-Python run: exact variants must agree to a relative tolerance, and --approx runs must keep
+their percentiles within the requested rank error.
+"""
+
+import os
+import sys
+import math
+import time
+import random
+import logging
+import argparse
+import itertools
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict, List, Tuple
+
+COL_STATS = Path(__file__).resolve().parent / 'col-stats.py'
+STAT_SETS = {
+    'default': None,
+    'all': 'all',
+    'moments': 'count,mean,std,min,max,sum',
+    'quantiles': '25p,50p,75p,iq_range,iq_mean',
+}
+VARIANTS = {
+    'python': ['--backend', 'python'],
+    'numpy': ['--backend', 'numpy'],
+    'jobs': ['--backend', 'python', '--jobs', str(os.cpu_count() or 1)],
+    'approx': ['--backend', 'python', '--approx'],
+}
+APPROX_ERROR = 0.01
+QUANTILES = {'25p': 0.25, '50p': 0.5, '75p': 0.75}
+EXACT_TOLERANCE = 1e-9
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark col-stats.py. The default shapes run in seconds, '
+        'pass larger ones with -r/-c, e.g. -r 100000 -c 1000.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument('-r', '--rows', type=int, nargs='+', default=[1000, 10000], help='Row counts')
+    parser.add_argument('-c', '--cols', type=int, nargs='+', default=[5, 50], help='Numeric column counts')
+    parser.add_argument('--header-rows', type=int, default=1, help='Number of header rows')
+    parser.add_argument('--text-cols', type=int, default=1, help='Number of non-numeric columns')
+    parser.add_argument(
+        '-s', '--stats', nargs='+', choices=list(STAT_SETS), default=['default', 'all'], help='Stat sets'
+    )
+    parser.add_argument(
+        '-v', '--variants', nargs='+', choices=list(VARIANTS), default=list(VARIANTS), help='Variants to run'
+    )
+    parser.add_argument('-n', '--repeat', type=int, default=1, help='Runs per variant, the fastest is reported')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic data')
+    return parser.parse_args()
+
+
+def make_table(path: Path, rows: int, cols: int, header_rows: int, text_cols: int, seed: int):
+    """
+    Write a synthetic TSV. Rows are written as they are generated, since the peak RSS of the
+    benchmarked subprocesses includes the memory of this process at the time of the fork.
+    """
+    rng = random.Random(seed)
+    # a mix of continuous, heavy-tailed and tied values
+    gens = [
+        lambda: rng.gauss(0, 1),
+        lambda: rng.expovariate(1),
+        lambda: float(rng.randint(0, 50)),
+    ]
+    col_gens = [gens[i % len(gens)] for i in range(cols)]
+    with open(path, 'w') as f:
+        for h in range(header_rows):
+            names = [f'text{i}_{h}' for i in range(text_cols)] + [f'col{i}_{h}' for i in range(cols)]
+            f.write('\t'.join(names) + '\n')
+        for _ in range(rows):
+            values = [round(gen(), 6) for gen in col_gens]
+            words = [rng.choice(['chr1', 'chr2', 'chrX', 'chrM']) for _ in range(text_cols)]
+            f.write('\t'.join(words + [repr(x) for x in values]) + '\n')
+
+
+def count_ranks(
+    path: Path, header_rows: int, queries: Dict[int, List[float]]
+) -> Tuple[Dict[Tuple[int, float], List[int]], int]:
+    """
+    Count the values below and up to each queried value of a column in one pass over the table,
+    giving the range of ranks the value occupies, along with the number of rows.
+    """
+    ranks = {(col, x): [0, 0] for col, xs in queries.items() for x in xs}
+    n = 0
+    with open(path) as f:
+        for line in itertools.islice(f, header_rows, None):
+            n += 1
+            row = line.rstrip('\n').split('\t')
+            for (col, x), rank in ranks.items():
+                value = float(row[col])
+                rank[0] += value < x
+                rank[1] += value <= x
+    return ranks, n
+
+
+def run_col_stats(args: List[str]) -> Tuple[float, int, str]:
+    """Run col-stats.py, and return its wall time in seconds, peak RSS in KiB and output."""
+    with TemporaryDirectory() as tmp:
+        out_path = Path(tmp) / 'out.tsv'
+        with open(out_path, 'w') as out:
+            start = time.perf_counter()
+            proc = subprocess.Popen([sys.executable, str(COL_STATS), *args], stdout=out)
+            _, status, rusage = os.wait4(proc.pid, 0)
+            wall = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
+        return wall, rusage.ru_maxrss, out_path.read_text()
+
+
+def parse_output(out: str) -> Dict[str, Dict[str, str]]:
+    lines = [line.split('\t') for line in out.splitlines()]
+    header, rows = lines[0], lines[1:]
+    return {row[0]: dict(zip(header, row)) for row in rows}
+
+
+def check_agreement(
+    base: Dict[str, Dict[str, str]],
+    other: Dict[str, Dict[str, str]],
+    path: Path,
+    header_rows: int,
+    approx: bool,
+) -> List[str]:
+    """Differences of `other` from the exact `base` output, as readable messages."""
+    if base.keys() != other.keys():
+        return [f'columns {sorted(base)} != {sorted(other)}']
+    problems = []
+    quantile_checks = []
+    for col_id, stats in base.items():
+        for stat, expected in stats.items():
+            got = other[col_id][stat]
+            if stat in ['column_id', 'column_name'] or got == expected:
+                continue
+            if approx and stat in QUANTILES:
+                quantile_checks.append((int(col_id) - 1, stat, float(got)))
+                continue
+            if approx and stat in ['iq_range', 'iq_mean', 'skewness', 'kurtosis']:
+                # derived from the approximate quantiles, checked through them
+                continue
+            if expected != 'nan' and got != 'nan':
+                if math.isclose(float(got), float(expected), rel_tol=EXACT_TOLERANCE, abs_tol=EXACT_TOLERANCE):
+                    continue
+            problems.append(f'column {col_id} {stat}: {got} != {expected}')
+
+    queries = {}
+    for col, _, x in quantile_checks:
+        queries.setdefault(col, []).append(x)
+    ranks, n = count_ranks(path, header_rows, queries) if queries else ({}, 0)
+    for col, stat, x in quantile_checks:
+        lo, hi = ranks[col, x]
+        target = QUANTILES[stat] * n
+        # normalized rank error of the approximate quantile, with slack for the sketch
+        error = abs(min(max(target, lo), hi) - target) / n
+        if error > 3 * APPROX_ERROR:
+            problems.append(f'column {col + 1} {stat}: {x} is off by a rank error of {error:.4f}')
+    return problems
+
+
+def main():
+    args = get_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        if 'numpy' in args.variants:
+            logging.warning('NumPy is not installed, skipping the numpy variant.')
+            args.variants.remove('numpy')
+
+    failed = False
+    print('\t'.join(['rows', 'cols', 'stats', 'variant', 'wall_s', 'peak_rss_mib', 'agreement']))
+    with TemporaryDirectory() as tmp:
+        for rows, cols in itertools.product(args.rows, args.cols):
+            path = Path(tmp) / f'{rows}x{cols}.tsv'
+            make_table(path, rows, cols, args.header_rows, args.text_cols, args.seed)
+            for stat_set in args.stats:
+                cmd = [str(path), '-r', '12']
+                if STAT_SETS[stat_set] is not None:
+                    cmd.append(f'--stats={STAT_SETS[stat_set]}')
+                _, _, base_out = run_col_stats([*cmd, *VARIANTS['python']])
+                base = parse_output(base_out)
+                for variant in args.variants:
+                    variant_cmd = [*cmd, *VARIANTS[variant]]
+                    if variant == 'approx':
+                        variant_cmd.append(f'--approx-error={APPROX_ERROR}')
+                    runs = [run_col_stats(variant_cmd) for _ in range(args.repeat)]
+                    wall = min(x[0] for x in runs)
+                    peak_rss = max(x[1] for x in runs)
+                    problems = check_agreement(
+                        base, parse_output(runs[0][2]), path, args.header_rows, variant == 'approx'
+                    )
+                    failed |= bool(problems)
+                    for problem in problems:
+                        logging.error(f'{rows}x{cols} {stat_set} {variant}: {problem}')
+                    agreement = 'ok' if not problems else f'{len(problems)} mismatches'
+                    fields = [str(rows), str(cols), stat_set, variant, f'{wall:.3f}', f'{peak_rss / 1024:.1f}']
+                    print('\t'.join([*fields, agreement]), flush=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
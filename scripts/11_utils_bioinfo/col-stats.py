@@ -4,9 +4,217 @@ from pathlib import Path
 import argparse
 import logging
 import io
+import os
 import csv
 import sys
-from typing import Any, Dict, List, Optional, Union
+import json
+import bz2
+import gzip
+import lzma
+import locale
+import math
+import mmap
+import random
+import itertools
+from array import array
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class KLLSketch:
+    """
+    Mergeable quantile sketch after Karnin, Lang and Liberty (2016). Keeps O(k) items, and answers
+    rank queries within roughly 2.3 / k ** 0.97 * n of the true rank.
+    """
+
+    def __init__(self, k: int = 200, seed: int = 0):
+        self.k = k
+        self.compactors: List[List[float]] = []
+        self.size = 0
+        self.max_size = 0
+        self._rng = random.Random(seed)
+        self._grow()
+
+    @classmethod
+    def for_error(cls, eps: float) -> 'KLLSketch':
+        """Create a sketch sized for a normalized rank error of `eps`."""
+        return cls(k=max(8, math.ceil((2.296 / eps) ** (1 / 0.9723))))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'k': self.k, 'compactors': self.compactors}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> 'KLLSketch':
+        sketch = cls(k=d['k'])
+        sketch.compactors = [list(c) for c in d['compactors']] or [[]]
+        sketch.size = sum(len(c) for c in sketch.compactors)
+        sketch.max_size = sum(sketch._capacity(h) for h in range(len(sketch.compactors)))
+        return sketch
+
+    def _grow(self):
+        self.compactors.append([])
+        self.max_size = sum(self._capacity(h) for h in range(len(self.compactors)))
+
+    def _capacity(self, height: int) -> int:
+        depth = len(self.compactors) - height - 1
+        return math.ceil(self.k * (2 / 3) ** depth) + 1
+
+    def add(self, x: float):
+        self.compactors[0].append(x)
+        self.size += 1
+        if self.size >= self.max_size:
+            self._compress()
+
+    def _compress(self):
+        for h in range(len(self.compactors)):
+            if len(self.compactors[h]) >= self._capacity(h):
+                if h + 1 >= len(self.compactors):
+                    self._grow()
+                # keep every other item of the sorted compactor at twice the weight one level up
+                c = sorted(self.compactors[h])
+                keep_last = [c.pop()] if len(c) % 2 else []
+                self.compactors[h + 1].extend(c[self._rng.random() < 0.5 :: 2])
+                self.compactors[h] = keep_last
+                self.size = sum(len(x) for x in self.compactors)
+                if self.size < self.max_size:
+                    break
+
+    def merge(self, other: 'KLLSketch'):
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+        for h, c in enumerate(other.compactors):
+            self.compactors[h].extend(c)
+        self.size = sum(len(x) for x in self.compactors)
+        while self.size >= self.max_size:
+            self._compress()
+
+    def _weighted(self) -> List[Tuple[float, int]]:
+        return sorted((x, 2**h) for h, c in enumerate(self.compactors) for x in c)
+
+    def quantile(self, q: float) -> float:
+        """Approximate the item at rank int(n * q) of the sorted stream."""
+        items = self._weighted()
+        rank = int(sum(w for _, w in items) * q)
+        cum = 0
+        for x, w in items:
+            cum += w
+            if cum > rank:
+                return x
+        return items[-1][0]
+
+    def mean_between(self, lo: float, hi: float) -> Union[float, str]:
+        """Approximate the mean of the items ranked from int(n * lo) up to int(n * hi)."""
+        items = self._weighted()
+        total = sum(w for _, w in items)
+        lo_rank, hi_rank = int(total * lo), int(total * hi)
+        cum = 0
+        wsum = 0.0
+        wcount = 0
+        for x, w in items:
+            # the part of this item's weight which falls into [lo_rank, hi_rank)
+            w_in = max(0, min(cum + w, hi_rank) - max(cum, lo_rank))
+            wsum += x * w_in
+            wcount += w_in
+            cum += w
+        return wsum / wcount if wcount else 'nan'
+
+
+class ColAccumulator:
+    """
+    Single-pass summary of a numeric column: count, sum, min, max and the running sum of squared
+    deviations from the mean (Welford). Values are only kept if order statistics are needed, or
+    summarized in a quantile sketch and a count of distinct values if approximations suffice.
+    """
+
+    __slots__ = ('count', 'sum', 'min', 'max', 'mean', 'm2', 'values', 'sketch', 'counts')
+
+    def __init__(
+        self,
+        keep_values: bool = False,
+        sketch: Optional[KLLSketch] = None,
+        count_values: bool = False,
+    ):
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.values = array('d') if keep_values else None
+        self.sketch = sketch
+        self.counts = Counter() if count_values else None
+
+    def add(self, x: float):
+        self.count += 1
+        self.sum += x
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if self.values is not None:
+            self.values.append(x)
+        if self.sketch is not None:
+            self.sketch.add(x)
+        if self.counts is not None:
+            self.counts[x] += 1
+
+    def merge(self, other: 'ColAccumulator'):
+        """Fold in the accumulator of another part of the same column (Chan et al.)."""
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if self.values is not None:
+            self.values.extend(other.values)
+        if self.sketch is not None:
+            self.sketch.merge(other.sketch)
+        if self.counts is not None:
+            self.counts.update(other.counts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = {x: getattr(self, x) for x in ['count', 'sum', 'min', 'max', 'mean', 'm2']}
+        if self.values is not None:
+            d['values'] = self.values.tolist()
+        if self.sketch is not None:
+            d['sketch'] = self.sketch.to_dict()
+        if self.counts is not None:
+            # as pairs, since JSON object keys are strings
+            d['counts'] = list(self.counts.items())
+        return d
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> 'ColAccumulator':
+        acc = cls(
+            keep_values='values' in d,
+            sketch=KLLSketch.from_dict(d['sketch']) if 'sketch' in d else None,
+            count_values='counts' in d,
+        )
+        for x in ['count', 'sum', 'min', 'max', 'mean', 'm2']:
+            setattr(acc, x, d[x])
+        if acc.values is not None:
+            acc.values.extend(d['values'])
+        if acc.counts is not None:
+            acc.counts.update(dict(d['counts']))
+        return acc
 
 
 class ColStats:
@@ -35,7 +243,22 @@ class ColStats:
         'skewness',
         'kurtosis',
     ]
+    # stats which require all values of a column to be kept in memory
+    QUANTILE_STATS = ['25p', '50p', '75p', 'iq_range', 'iq_mean', 'skewness', 'kurtosis']
+    STAT_DEPS = {
+        'iq_range': ['25p', '75p'],
+        'skewness': ['50p'],
+        'kurtosis': ['75p'],
+    }
     HEADER_CONCAT = '__'
+    CHUNK_SIZE = 1 << 20
+    READ_BUFFER_SIZE = 1 << 20
+    COMPRESSION_MAGIC = {
+        b'\x1f\x8b': 'gzip',
+        b'BZh': 'bz2',
+        b'\xfd7zXZ\x00': 'xz',
+        b'\x28\xb5\x2f\xfd': 'zstd',
+    }
 
     @classmethod
     def _get_args(cls):
@@ -61,7 +284,7 @@ class ColStats:
             default='auto',
             help='Number of header rows to skip, or auto to skip all rows that are not numeric',
         )
-        parser.add_argument('-r', '--round-to', default=3, help='Round to this many decimal places')
+        parser.add_argument('-r', '--round-to', type=int, default=3, help='Round to this many decimal places')
         parser.add_argument(
             '--skip-cols',
             default=0,
@@ -75,6 +298,51 @@ class ColStats:
             default=','.join(cls.DEFAULT_STATS),
             help=f'Comma-separated list of stats to show, or "all". Prefix with "+" to include default stats (existing: {",".join(cls.KNOWN_STATS)})',
         )
+        parser.add_argument(
+            '--approx',
+            action='store_true',
+            help='Approximate percentiles and interquartile stats in bounded memory using quantile sketches',
+        )
+        parser.add_argument(
+            '--approx-error',
+            type=float,
+            default=0.01,
+            help='Targeted rank error of approximated percentiles, as a fraction of the row count',
+        )
+        parser.add_argument(
+            '--backend',
+            choices=['auto', 'numpy', 'python'],
+            default='auto',
+            help='Compute stats in pure Python, streaming the input, or with vectorized NumPy calls, which is faster '
+            'for some stats but holds all rows in memory. auto picks python, NumPy is opt-in',
+        )
+        parser.add_argument(
+            '-j',
+            '--jobs',
+            type=int,
+            default=1,
+            help='Number of processes to parse and summarize chunks of rows with (python backend)',
+        )
+        parser.add_argument(
+            '-g',
+            '--group-by',
+            type=int,
+            default=None,
+            help='Field (1-indexed) to group rows by, to summarize each field per distinct value of it',
+        )
+        parser.add_argument(
+            '--emit-partial',
+            action='store_true',
+            help='Write the accumulated state as JSON instead of stats, to be combined later with --merge',
+        )
+        parser.add_argument(
+            '--merge',
+            nargs='+',
+            type=Path,
+            default=None,
+            metavar='PARTIAL',
+            help='Combine files written by --emit-partial into final stats, instead of reading input',
+        )
         return parser.parse_args()
 
     @staticmethod
@@ -119,66 +387,461 @@ class ColStats:
         self._field_selection = self._args.field
         self._required_fields = self._parse_field_selection(self._field_selection)
         self._pretty_print = self._args.pretty
+        self._approx = self._args.approx
+        self._jobs = max(1, self._args.jobs)
+        self._maxsplit = -1
+        self._group_field = None
+        self._grouped = False
+        self._backend = self._get_backend(self._args.backend)
+
+    @classmethod
+    def _sniff_compression(cls, f: io.BufferedReader) -> Optional[str]:
+        head = f.peek(6)[:6]
+        return next((v for k, v in cls.COMPRESSION_MAGIC.items() if head.startswith(k)), None)
 
-    def _get_raw_lines(self) -> List[str]:
+    def _open_input(self, f: io.BufferedReader) -> io.TextIOWrapper:
+        """Wrap a binary input stream, decompressing it if it starts with a known magic number."""
+        compression = self._sniff_compression(f)
+        if compression == 'gzip':
+            f = gzip.GzipFile(fileobj=f)
+        elif compression == 'bz2':
+            f = bz2.BZ2File(f)
+        elif compression == 'xz':
+            f = lzma.LZMAFile(f)
+        elif compression == 'zstd':
+            if zstandard is None:
+                raise SystemExit('Reading zstd compressed input requires the zstandard package.')
+            # concatenated shards are separate frames, all of which are to be read
+            f = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        if compression is not None:
+            f = io.BufferedReader(f, buffer_size=self.READ_BUFFER_SIZE)
+        return io.TextIOWrapper(f)
+
+    def _get_raw_lines(self) -> Iterator[str]:
         if self._args.infile is not None:
-            with open(self._args.infile, 'r') as f:
-                return f.readlines()
+            with open(self._args.infile, 'rb', buffering=self.READ_BUFFER_SIZE) as f:
+                yield from self._open_input(f)
+        else:
+            yield from self._open_input(sys.stdin.buffer)
+
+    def _is_mappable(self) -> bool:
+        """Whether the input is an uncompressed regular file, which workers can map themselves."""
+        if self._args.infile is None or not self._args.infile.is_file():
+            return False
+        with open(self._args.infile, 'rb') as f:
+            return self._sniff_compression(f) is None and os.fstat(f.fileno()).st_size > 0
+
+    def _find_data_offset(self, n_header: int) -> int:
+        """Byte offset after the first `n_header` non-blank lines of the input file."""
+        with open(self._args.infile, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                while n_header:
+                    line = mm.readline()
+                    if not line:
+                        break
+                    if line.strip():
+                        n_header -= 1
+                return mm.tell()
+
+    def _chunk_ranges(self, start: int) -> Iterator[Tuple[int, int]]:
+        """Split the input file from `start` into byte ranges of whole lines."""
+        with open(self._args.infile, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                while start < len(mm):
+                    end = mm.find(b'\n', min(start + self.CHUNK_SIZE, len(mm)))
+                    end = len(mm) if end < 0 else end + 1
+                    yield start, end
+                    start = end
+
+    def _accumulate_range(
+        self, start: int, end: int
+    ) -> Dict[Optional[str], Dict[int, Optional[ColAccumulator]]]:
+        with open(self._args.infile, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                chunk = mm[start:end].decode(locale.getpreferredencoding(False))
+        return self._accumulate(line for line in map(str.strip, chunk.split('\n')) if line)
+
+    def _get_lines(self) -> Iterator[str]:
+        for line in self._get_raw_lines():
+            line = line.strip()
+            if line:
+                yield line
+
+    def _split_header(
+        self, lines: Iterator[str], fields: List[int]
+    ) -> Tuple[List[List[str]], Iterator[str]]:
+        """
+        Consume the header rows, and return them along with an iterator over the data lines.
+        With automatic skipping, the header ends at the first row with any numeric field.
+        """
+        header = []
+        if self._skip == 'auto':
+            for line in lines:
+                row = self._split(line)
+                if any(self._isnumeric(row[f]) for f in fields if f < len(row)):
+                    return header, itertools.chain([line], lines)
+                header.append(row)
+        else:
+            skipped = itertools.islice(lines, int(self._skip))
+            header.extend(self._split(line) for line in skipped)
+        return header, lines
+
+    def _split(self, line: str) -> List[str]:
+        """Split a line into fields, dropping any fields after the last required one."""
+        if self._maxsplit < 0:
+            return line.split(self._args.delimiter)
+        return line.split(self._args.delimiter, self._maxsplit)[: self._maxsplit]
+
+    def _chunk_lines(self, lines: Iterator[str]) -> Iterator[List[str]]:
+        chunk = []
+        chunk_size = 0
+        for line in lines:
+            chunk.append(line)
+            chunk_size += len(line)
+            if chunk_size >= self.CHUNK_SIZE:
+                yield chunk
+                chunk = []
+                chunk_size = 0
+        if chunk:
+            yield chunk
+
+    def _get_backend(self, backend: str) -> str:
+        # the numpy backend holds the whole input in memory, which only pays off when asked for
+        if backend in ('auto', 'python'):
+            return 'python'
+        if np is None:
+            reason = 'NumPy is not installed'
+        elif self._approx or self._args.emit_partial:
+            reason = '--approx and --emit-partial need the accumulators of the python backend'
+        else:
+            if self._jobs > 1:
+                logging.warning('--jobs is ignored by the numpy backend.')
+            return backend
+        logging.warning(f'{reason}, falling back to the python backend.')
+        return 'python'
+
+    def _new_accumulator(self) -> ColAccumulator:
+        need_quantiles = any(x in self.QUANTILE_STATS for x in self._usestats)
+        if need_quantiles and not self._approx:
+            # the mode is taken from the sorted values in this case
+            return ColAccumulator(keep_values=True)
+        return ColAccumulator(
+            sketch=KLLSketch.for_error(self._args.approx_error) if need_quantiles else None,
+            count_values='mode' in self._usestats,
+        )
+
+    @staticmethod
+    def _sorted_mode(col: List[float]) -> float:
+        """Most frequent value of a sorted list, the smallest one on ties."""
+        mode, mode_count = col[0], 0
+        for x, run in itertools.groupby(col):
+            run_count = sum(1 for _ in run)
+            if run_count > mode_count:
+                mode, mode_count = x, run_count
+        return mode
+
+    def _calc_col(self, acc: ColAccumulator) -> Dict[str, Any]:
+        need = set(self._usestats)
+        need.update(dep for x in self._usestats for dep in self.STAT_DEPS.get(x, []))
+        n = acc.count
+        stats = {'count': n}
+        stats['mean'] = acc.sum / n
+        stats['std'] = (acc.m2 / n) ** 0.5
+        stats['min'] = acc.min
+        stats['max'] = acc.max
+        stats['sum'] = acc.sum
+        if acc.values is not None:
+            col = sorted(acc.values)
+            for q, name in [(0.25, '25p'), (0.5, '50p'), (0.75, '75p')]:
+                if name in need:
+                    stats[name] = col[int(n * q)]
+            if 'mode' in need:
+                stats['mode'] = self._sorted_mode(col)
+            if 'iq_mean' in need:
+                iq = col[int(n * 0.25) : int(n * 0.75)]
+                stats['iq_mean'] = sum(iq) / len(iq) if iq else 'nan'
         else:
-            return sys.stdin.readlines()
-
-    def _calc_col(self, col: List[float]) -> Dict[str, Any]:
-        col = col.copy()
-        stats = {'count': len(col)}
-        stats['mean'] = sum(col) / stats['count']
-        stats['std'] = (sum([(x - stats['mean']) ** 2 for x in col]) / stats['count']) ** 0.5
-        col.sort()
-        stats['min'] = col[0]
-        stats['max'] = col[-1]
-        stats['sum'] = sum(col)
-        stats['25p'] = col[int(stats['count'] * 0.25)]
-        stats['50p'] = col[int(stats['count'] * 0.5)]
-        stats['75p'] = col[int(stats['count'] * 0.75)]
-        stats['mode'] = max(set(col), key=col.count)
-        stats['iq_range'] = stats['75p'] - stats['25p']
-        iq = col[int(stats['count'] * 0.25) : int(stats['count'] * 0.75)]
-        stats['iq_mean'] = sum(iq) / len(iq) if iq else 'nan'
-        stats['skewness'] = (stats['mean'] - stats['50p']) / stats['std'] if stats['std'] else 'nan'
-        stats['kurtosis'] = (stats['mean'] - stats['75p']) / stats['std'] if stats['std'] else 'nan'
+            if acc.sketch is not None:
+                for q, name in [(0.25, '25p'), (0.5, '50p'), (0.75, '75p')]:
+                    if name in need:
+                        stats[name] = acc.sketch.quantile(q)
+                if 'iq_mean' in need:
+                    stats['iq_mean'] = acc.sketch.mean_between(0.25, 0.75)
+            if 'mode' in need:
+                # smallest value on ties, as with sorted values
+                stats['mode'] = min(acc.counts.items(), key=lambda kv: (-kv[1], kv[0]))[0]
+        if 'iq_range' in need:
+            stats['iq_range'] = stats['75p'] - stats['25p']
+        std = stats['std']
+        if 'skewness' in need:
+            stats['skewness'] = (stats['mean'] - stats['50p']) / std if std else 'nan'
+        if 'kurtosis' in need:
+            stats['kurtosis'] = (stats['mean'] - stats['75p']) / std if std else 'nan'
         stats = {x: stats[x] for x in self._usestats}
         return stats
 
-    def _get_col(self, field: int, lines: List[List[str]]) -> Optional[Dict[str, Any]]:
-        if self._skip == 'auto':
-            header_items = []
-            for i, l in enumerate(lines):
-                if not self._isnumeric(l[field]):
-                    header_items.append(l[field])
+    def _group_key(self, row: List[str]) -> Optional[str]:
+        if self._group_field is None:
+            return None
+        return row[self._group_field] if self._group_field < len(row) else ''
+
+    def _accumulate(
+        self, lines: Iterable[str]
+    ) -> Dict[Optional[str], Dict[int, Optional[ColAccumulator]]]:
+        """
+        Accumulate each required field per group, with None for fields which are not numeric.
+        Without --group-by, all rows are in a single group None.
+        """
+        groups = {}
+        live = {}
+        failed = set()
+        for line in lines:
+            row = self._split(line)
+            key = self._group_key(row)
+            accs = live.get(key)
+            if accs is None:
+                accs = live[key] = {f: self._new_accumulator() for f in self._required_fields}
+                groups[key] = accs.copy()
+            for field, acc in accs.items():
+                try:
+                    acc.add(float(row[field + self._skip_cols]))
+                except (ValueError, IndexError):
+                    failed.add(field)
+            if failed:
+                for field in failed:
+                    accs.pop(field, None)
+                    groups[key][field] = None
+                failed = set()
+        return groups
+
+    def _accumulate_parallel(
+        self, lines: Iterator[str], data_offset: Optional[int] = None
+    ) -> Dict[Optional[str], Dict[int, Optional[ColAccumulator]]]:
+        """
+        Accumulate chunks of lines in a process pool, and merge the results in input order to
+        stay deterministic. Only a few chunks per process are in flight at any time. With a
+        data offset into an uncompressed input file, workers map the file and read their byte
+        range of it themselves, instead of being sent the lines.
+        """
+        groups = {}
+
+        def merge(parts: Dict[Optional[str], Dict[int, Optional[ColAccumulator]]]):
+            self._merge_groups(groups, parts)
+
+        with ProcessPoolExecutor(self._jobs) as pool:
+            pending = deque()
+            if data_offset is not None:
+                tasks = (
+                    pool.submit(self._accumulate_range, start, end)
+                    for start, end in self._chunk_ranges(data_offset)
+                )
+            else:
+                tasks = (pool.submit(self._accumulate, chunk) for chunk in self._chunk_lines(lines))
+            for task in tasks:
+                pending.append(task)
+                if len(pending) >= 2 * self._jobs:
+                    merge(pending.popleft().result())
+            while pending:
+                merge(pending.popleft().result())
+        return groups
+
+    @staticmethod
+    def _merge_groups(
+        groups: Dict[Optional[str], Dict[int, Optional[ColAccumulator]]],
+        parts: Dict[Optional[str], Dict[int, Optional[ColAccumulator]]],
+    ):
+        """Merge accumulators of a later part of the input into `groups`, in place."""
+        for key, part_accs in parts.items():
+            accs = groups.setdefault(key, part_accs)
+            if accs is part_accs:
+                continue
+            for field, part in part_accs.items():
+                if field not in accs:
+                    accs[field] = part
+                elif part is None or accs[field] is None:
+                    accs[field] = None
                 else:
-                    self._skip = i
-                    break
-            header = self.HEADER_CONCAT.join(header_items)
-        else:
-            header = self.HEADER_CONCAT.join([x[field] for x in lines[: int(self._skip)]])
-        field = field + self._skip_cols
+                    accs[field].merge(part)
+
+    def _accumulate_input(
+        self, lines: Iterator[str], n_header: int
+    ) -> Dict[Optional[str], Dict[int, Optional[ColAccumulator]]]:
+        if self._jobs > 1:
+            data_offset = self._find_data_offset(n_header) if self._is_mappable() else None
+            return self._accumulate_parallel(lines, data_offset)
+        return self._accumulate(lines)
+
+    def _summarize_python(
+        self, groups: Dict[Optional[str], Dict[int, Optional[ColAccumulator]]]
+    ) -> Dict[Optional[str], Dict[int, Optional[Dict[str, Any]]]]:
+        """
+        Stats of each required field which has values per group, or None for fields which are
+        not numeric.
+        """
+        return {
+            key: {
+                field: self._calc_col(acc) if acc is not None else None
+                for field, acc in accs.items()
+                if acc is None or acc.count
+            }
+            for key, accs in groups.items()
+        }
+
+    def _write_partial(
+        self,
+        groups: Dict[Optional[str], Dict[int, Optional[ColAccumulator]]],
+        col_names: Dict[int, str],
+    ):
+        """Write accumulators to stdout, keyed by absolute 0-indexed column."""
+        partial = {
+            'group_by': self._grouped,
+            'columns': {field + self._skip_cols: name for field, name in col_names.items()},
+            'groups': [
+                [
+                    key,
+                    {
+                        field + self._skip_cols: acc.to_dict() if acc is not None else None
+                        for field, acc in accs.items()
+                    },
+                ]
+                for key, accs in groups.items()
+            ],
+        }
+        json.dump(partial, sys.stdout)
+        sys.stdout.write('\n')
+
+    def _read_partials(
+        self, paths: List[Path]
+    ) -> Tuple[Dict[Optional[str], Dict[int, Optional[ColAccumulator]]], Dict[int, str]]:
+        """
+        Merge the accumulators of files written by --emit-partial, in the given order. Parts of
+        the accumulators which the requested stats do not need are dropped, and the ones they
+        need must be present.
+        """
+        template = self._new_accumulator()
+        groups = {}
+        col_names = {}
+        for path in paths:
+            with open(path) as f:
+                partial = json.load(f)
+            self._grouped |= partial['group_by']
+            for field, name in partial['columns'].items():
+                if not col_names.get(int(field)):
+                    col_names[int(field)] = name
+            parts = {}
+            for key, accs in partial['groups']:
+                parts[key] = {}
+                for field, d in accs.items():
+                    acc = ColAccumulator.from_dict(d) if d is not None else None
+                    if acc is not None:
+                        for x in ['values', 'sketch', 'counts']:
+                            if getattr(template, x) is None:
+                                setattr(acc, x, None)
+                            elif getattr(acc, x) is None:
+                                raise SystemExit(
+                                    f'{path} lacks the {x} needed for the requested stats. '
+                                    'Use the same --stats and --approx for --emit-partial.'
+                                )
+                    parts[key][int(field)] = acc
+            self._merge_groups(groups, parts)
+        self._required_fields = sorted(col_names)
+        self._skip_cols = 0
+        return groups, col_names
+
+    def _summarize_numpy_groups(
+        self, rows: List[List[str]]
+    ) -> Optional[Dict[Optional[str], Dict[int, Optional[Dict[str, Any]]]]]:
+        """Same as _summarize_python, with the rows of each group summarized by NumPy."""
+        grouped = {}
+        for row in rows:
+            grouped.setdefault(self._group_key(row), []).append(row)
+        calced = {}
+        for key, group_rows in grouped.items():
+            calced[key] = self._summarize_numpy(group_rows)
+            if calced[key] is None:
+                return None
+        return calced
+
+    def _summarize_numpy(
+        self, rows: List[List[str]]
+    ) -> Optional[Dict[int, Optional[Dict[str, Any]]]]:
+        """
+        Same as _summarize_python, but with vectorized calls over a 2-D array of the selected
+        fields. Returns None if the rows do not fit into an array, e.g. for ragged rows.
+        """
+        if not rows:
+            return {}
+        fields = list(self._required_fields)
+        calced = {}
         try:
-            incol = [float(x[field]) for x in lines[int(self._skip) :]]
-        except ValueError:
-            if (
-                self._field_selection != 'all'
-            ):  # if we're doing all fields indiscriminately, don't warn
-                logging.warning(
-                    f'Could not convert field {field + 1} to float. Use --skip to skip header rows.'
-                )
-            return None
-        if len(incol) == 0:
-            return None
-        calced = self._calc_col(incol)
-        calced = {'column_id': str(field + 1), 'column_name': header, **calced}
+            # fast path: every field of the block is numeric
+            arr = np.array(rows, dtype=float)[:, [x + self._skip_cols for x in fields]]
+        except (ValueError, IndexError):
+            try:
+                block = np.array(rows, dtype=str)
+            except ValueError:
+                return None
+            if block.ndim != 2:
+                return None
+            cols = []
+            for field in self._required_fields:
+                try:
+                    cols.append(block[:, field + self._skip_cols].astype(float))
+                except (ValueError, IndexError):
+                    calced[field] = None
+                    fields.remove(field)
+            if not cols:
+                return calced
+            arr = np.column_stack(cols)
+        need = set(self._usestats)
+        need.update(dep for x in self._usestats for dep in self.STAT_DEPS.get(x, []))
+        n = arr.shape[0]
+        stats = {'count': [n] * arr.shape[1]}
+        stats['mean'] = arr.mean(axis=0)
+        stats['std'] = arr.std(axis=0)
+        stats['min'] = arr.min(axis=0)
+        stats['max'] = arr.max(axis=0)
+        stats['sum'] = arr.sum(axis=0)
+        if any(x in self.QUANTILE_STATS or x == 'mode' for x in need):
+            arr.sort(axis=0)
+            for q, name in [(0.25, '25p'), (0.5, '50p'), (0.75, '75p')]:
+                if name in need:
+                    stats[name] = arr[int(n * q)]
+            if 'mode' in need:
+                # on ties, argmax picks the first and thereby smallest of the sorted values
+                stats['mode'] = [
+                    values[counts.argmax()]
+                    for values, counts in (np.unique(col, return_counts=True) for col in arr.T)
+                ]
+            if 'iq_mean' in need:
+                lo, hi = int(n * 0.25), int(n * 0.75)
+                stats['iq_mean'] = arr[lo:hi].mean(axis=0) if hi > lo else ['nan'] * arr.shape[1]
+        if 'iq_range' in need:
+            stats['iq_range'] = stats['75p'] - stats['25p']
+        std = stats['std']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if 'skewness' in need:
+                skewness = (stats['mean'] - stats['50p']) / std
+                stats['skewness'] = np.where(std != 0, skewness, np.nan)
+            if 'kurtosis' in need:
+                kurtosis = (stats['mean'] - stats['75p']) / std
+                stats['kurtosis'] = np.where(std != 0, kurtosis, np.nan)
+        for i, field in enumerate(fields):
+            calced[field] = {x: self._to_python(stats[x][i]) for x in self._usestats}
         return calced
 
+    @staticmethod
+    def _to_python(x: Any) -> Any:
+        """Convert NumPy scalars, and NaN as used by the python backend for undefined stats."""
+        if isinstance(x, str):
+            return x
+        x = x.item() if hasattr(x, 'item') else x
+        return 'nan' if isinstance(x, float) and math.isnan(x) else x
+
     def _format_output(self, calced_lines: List[Dict[str, Any]], round_to: int) -> str:
         idx_cols = ['column_id', 'column_name'] if not self._args.no_out_index else []
+        if self._grouped and not self._args.no_out_index:
+            idx_cols.insert(0, 'group')
         header = [*idx_cols, *[x for x in self._usestats]]
 
         # pop the column name if it is empty for all
@@ -225,18 +888,70 @@ class ColStats:
             return fout.getvalue()
 
     def run(self):
-        lines = [x.strip().split(self._args.delimiter) for x in self._get_raw_lines()]
-        if self._required_fields is None:
-            self._required_fields = [0]
-        elif self._required_fields == 'all':
-            self._required_fields = list(range(len(lines[0])))
+        if self._args.merge is not None:
+            groups, col_names = self._read_partials(self._args.merge)
+            calced = self._summarize_python(groups)
         else:
-            pass
+            lines = self._get_lines()
+            first = next(lines, None)
+            if first is None:
+                return
+            lines = itertools.chain([first], lines)
+            first = first.split(self._args.delimiter)
+            if self._required_fields is None:
+                self._required_fields = [0]
+            elif self._required_fields == 'all':
+                self._required_fields = list(range(len(first)))
+            if self._args.group_by is not None:
+                # the key field is not summarized itself
+                group_field = self._args.group_by - 1
+                self._required_fields = [x for x in self._required_fields if x != group_field]
+                if not self._required_fields:
+                    raise SystemExit('The --group-by field cannot be the only field summarized, select others with -f.')
+                self._group_field = group_field + self._skip_cols
+                self._grouped = True
+            if self._field_selection != 'all':
+                # only tokenize lines up to the last required field
+                self._maxsplit = max(self._required_fields) + self._skip_cols + 1
+                if self._group_field is not None:
+                    self._maxsplit = max(self._maxsplit, self._group_field + 1)
+            header, lines = self._split_header(lines, self._required_fields)
+            col_names = {
+                field: self.HEADER_CONCAT.join([x[field] for x in header if field < len(x)])
+                for field in self._required_fields
+            }
+
+            if self._args.emit_partial:
+                self._write_partial(self._accumulate_input(lines, len(header)), col_names)
+                return
+            calced = None
+            if self._backend == 'numpy':
+                lines = list(lines)
+                calced = self._summarize_numpy_groups([self._split(line) for line in lines])
+            if calced is None:
+                calced = self._summarize_python(self._accumulate_input(iter(lines), len(header)))
+
         calced_lines = []
-        for field in self._required_fields:
-            calced = self._get_col(field, lines)
-            if calced is not None:
-                calced_lines.append(calced)
+        warned = set()
+        for key, calced_fields in calced.items():
+            for field in self._required_fields:
+                col_id = field + self._skip_cols
+                if field not in calced_fields:
+                    continue
+                if calced_fields[field] is None:
+                    if (
+                        self._field_selection != 'all' and field not in warned
+                    ):  # if we're doing all fields indiscriminately, don't warn
+                        logging.warning(
+                            f'Could not convert field {col_id + 1} to float. '
+                            'Use --skip to skip header rows.'
+                        )
+                        warned.add(field)
+                    continue
+                line = {'column_id': str(col_id + 1), 'column_name': col_names[field]}
+                if key is not None:
+                    line['group'] = key
+                calced_lines.append({**line, **calced_fields[field]})
         to_print = self._format_output(calced_lines, self._args.round_to)
         print(to_print, end='')
 